@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio front-end of the programmatic API (Python 3.5+).
+
+status and plan run their queries through the driver's execute_async so they
+don't block the event loop and can run concurrently with other startup work.
+migrate shells out to cqlsh and waits on schema agreement, so it runs the
+blocking api.migrate in an executor.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+import asyncio
+import functools
+
+from . import api
+from .db import get_cluster, open_session
+from .migrate import get_pending_migrations
+
+
+def execute(session, query, parameters=None, loop=None):
+    """ Execute the query with the driver and return an asyncio future of its rows. """
+    loop = loop or asyncio.get_event_loop()
+    future = loop.create_future()
+
+    def set_result(rows):
+        if not future.cancelled():
+            future.set_result(rows)
+
+    def set_exception(exc):
+        if not future.cancelled():
+            future.set_exception(exc)
+
+    response = session.execute_async(query, parameters)
+    response.add_callbacks(
+        lambda rows: loop.call_soon_threadsafe(set_result, rows),
+        lambda exc: loop.call_soon_threadsafe(set_exception, exc)
+    )
+    return future
+
+
+async def connect(config, cluster=None, loop=None):
+    """ Open a session without blocking the event loop. """
+    loop = loop or asyncio.get_event_loop()
+    cluster = cluster or get_cluster(config)
+    return await loop.run_in_executor(None, open_session, cluster)
+
+
+async def keyspace_exists(session, keyspace, loop=None):
+    rows = await execute(session, 'SELECT keyspace_name FROM system_schema.keyspaces WHERE keyspace_name = %s',
+                         [keyspace], loop=loop)
+    return bool(rows)
+
+
+async def get_last_migration(session, keyspace, loop=None):
+    """ Same as migrate.get_last_migration. """
+    try:
+        rows = await execute(
+            session, "SELECT migration FROM {}.shift_migrations WHERE type = 'MIGRATION' LIMIT 1".format(keyspace),
+            loop=loop)
+    except Exception:
+        return None
+    if not rows:
+        return 0
+    last = rows[0].migration
+    return last[:-4] if last.endswith('.cql') else last
+
+
+async def get_checkpoint(session, keyspace, name, loop=None):
+    """ Same as db.get_checkpoint. """
+    if name.endswith('.cql'):
+        name = name[:-4]
+    try:
+        rows = await execute(session,
+                             'SELECT hash, up, applied FROM {}.shift_checkpoints WHERE migration = %s'.format(keyspace),
+                             (name,), loop=loop)
+    except Exception:
+        return None
+    return rows[0] if rows else None
+
+
+async def _get_session(config, session, cluster, loop):
+    """ Return the session to use and the object to shut down when done (None if not ours). """
+    if session is not None:
+        return session, None
+    if cluster is not None:
+        session = await connect(config, cluster=cluster, loop=loop)
+        return session, session
+    session = await connect(config, loop=loop)
+    return session, session.cluster
+
+
+async def _close(owned, loop):
+    if owned is not None:
+        await (loop or asyncio.get_event_loop()).run_in_executor(None, owned.shutdown)
+
+
+async def status(config, session=None, cluster=None, loop=None):
+    """ Asynchronous api.status. """
+    migrations = api.get_migrations()
+    session, owned = await _get_session(config, session, cluster, loop)
+    try:
+        exists = await keyspace_exists(session, config['keyspace'], loop=loop)
+        last = await get_last_migration(session, config['keyspace'], loop=loop) if exists else None
+    finally:
+        await _close(owned, loop)
+    return api.make_status(migrations, exists, last)
+
+
+async def plan(config, head=None, session=None, cluster=None, loop=None):
+    """ Asynchronous api.plan. """
+    migrations = api.get_migrations()
+    session, owned = await _get_session(config, session, cluster, loop)
+    try:
+        last = None
+        if await keyspace_exists(session, config['keyspace'], loop=loop):
+            last = await get_last_migration(session, config['keyspace'], loop=loop)
+        pending, up = get_pending_migrations(last, migrations, head)
+        checkpoint = None
+        if pending and last is not None:
+            checkpoint = await get_checkpoint(session, config['keyspace'], pending[0], loop=loop)
+    finally:
+        await _close(owned, loop)
+    resume_from = api.check_checkpoint(checkpoint, pending, up)
+    return api.Plan(head=last, pending=pending, up=up, resume_from=resume_from)
+
+
+async def migrate(config, head=None, session=None, cluster=None, loop=None, executor=None, **kwargs):
+    """
+    Asynchronous api.migrate. The migration runs in the given executor
+    (the loop default if None); extra keyword arguments go to api.migrate.
+    """
+    loop = loop or asyncio.get_event_loop()
+    call = functools.partial(api.migrate, config, head=head, session=session, cluster=cluster, **kwargs)
+    return await loop.run_in_executor(executor, call)
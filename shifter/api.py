@@ -0,0 +1,456 @@
+# -*- coding: utf-8 -*-
+"""
+Programmatic access to shifter.
+
+Every function takes the configuration dict (see config.get_config) and
+optionally an existing session or cluster. Results are returned as named
+tuples and errors are raised as ShifterError instead of exiting.
+Migration files are read from the migrations directory of the current
+working directory, just like the CLI does.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+from collections import namedtuple
+
+from cassandra import AlreadyExists, InvalidRequest
+from cassandra.util import datetime_from_uuid1
+
+from .migrate import get_migrations_on_file, get_last_migration, get_pending_migrations
+from .migrate import apply_migration, read_migration, get_migration_statements, get_statements_hash
+from .db import get_cluster, open_session, get_current_schema, keyspace_exists, get_keyspace_tables
+from .db import create_migration_table, create_checkpoint_table, get_checkpoint, clear_checkpoint
+from .db import create_demo_keyspace, delete_demo_keyspace, get_demo_keyspace_name
+from .db import record_migration, update_snapshot, upgrade_migration_table, get_history
+from .db import SHIFT_TABLE, CHECKPOINT_TABLE
+from .lease import Lease, create_lease_table, wait_for_lease, LEASE_TABLE
+from .lint import lint_migrations, format_finding, ERROR
+from .estimate import estimate_migrations, DEFAULT_THROUGHPUT, format_seconds
+from .sample import get_touched_tables, copy_samples, get_timing
+from .pool import Pool, writes_data
+from .store import get_stored_snapshot, get_stored_migrations
+from .cql import parse_schema, get_statement_kind
+from .map import get_keyspace_diff
+from .output import echo, secho, quiet
+from .exceptions import ShifterError, MigrationError, LintError
+
+# The tables shifter creates in the keyspace, left out of the diffs.
+SHIFTER_TABLES = (SHIFT_TABLE, CHECKPOINT_TABLE, LEASE_TABLE)
+
+Status = namedtuple('Status', ['initialized', 'head', 'file_head', 'pending'])
+Plan = namedtuple('Plan', ['head', 'pending', 'up', 'resume_from'])
+MigrationResult = namedtuple('MigrationResult', ['head', 'applied', 'up', 'delegated', 'rehearsal'])
+HistoryEntry = namedtuple('HistoryEntry', ['time', 'migration', 'action', 'duration', 'statements',
+                                           'coordinator', 'rehearsal'])
+
+
+def get_migrations():
+    """ Return the migrations on file, making sure the genesis is there. """
+    migrations = get_migrations_on_file()
+    if not migrations:
+        raise MigrationError('No migrations found on the current directory.')
+    if '00000.cql' not in migrations:
+        raise MigrationError('Migration genesis (00000.cql) is missing! Forgot to run init command first?')
+    return migrations
+
+
+def make_status(migrations, exists, last):
+    """ Build the Status of a keyspace given its state in Cassandra. """
+    initialized = exists and last is not None
+    pending, up = get_pending_migrations(last if initialized else None, migrations)
+    return Status(initialized=initialized, head=(last if initialized else None),
+                  file_head=migrations[-1][:-4], pending=pending)
+
+
+def get_resume_point(config, pending, up, session):
+    """
+    Return the number of statements of the first pending migration that
+    were already applied by an interrupted run (0 if it wasn't interrupted).
+    """
+    return check_checkpoint(get_checkpoint(config['keyspace'], pending[0], session=session), pending, up)
+
+
+def check_checkpoint(checkpoint, pending, up):
+    """
+    Validate the checkpoint of the first pending migration and return its
+    resume point. Only the statements before it must be unchanged.
+    """
+    if checkpoint is None or checkpoint.up != up:
+        # A checkpoint in the other direction is left by a run that died right
+        # after recording the head, the migration was completed.
+        return 0
+    content = read_migration(pending[0])
+    statements = get_migration_statements(content, up) if content is not None else None
+    if (statements is None or len(statements) < checkpoint.applied or
+            get_statements_hash(statements[:checkpoint.applied]) != checkpoint.hash):
+        raise MigrationError('Migration {} was interrupted but the {} statements it already applied have changed '
+                             'since. Unable to resume, run again with --discard-checkpoint to apply it from its '
+                             'first statement.'.format(pending[0], checkpoint.applied), migration=pending[0])
+    return checkpoint.applied
+
+
+class _Connection(object):
+    """ Use the given session or open one that is closed on exit. """
+    def __init__(self, config, session=None, cluster=None):
+        self.config = config
+        self.session = session
+        self.cluster = cluster
+        self.owned_cluster = False
+        self.owned_session = False
+
+    def __enter__(self):
+        if self.session is not None:
+            return self.session
+        if self.cluster is None:
+            self.cluster = get_cluster(self.config)
+            self.owned_cluster = True
+        self.session = open_session(self.cluster)
+        self.owned_session = True
+        return self.session
+
+    def __exit__(self, *exc):
+        if self.owned_cluster:
+            self.cluster.shutdown()
+        elif self.owned_session:
+            self.session.shutdown()
+
+
+def status(config, session=None, cluster=None):
+    """ Return the Status of the configured keyspace against the migrations on file. """
+    migrations = get_migrations()
+    with _Connection(config, session, cluster) as session:
+        exists = keyspace_exists(config['keyspace'], session=session)
+        last = get_last_migration(config, session=session) if exists else None
+    return make_status(migrations, exists, last)
+
+
+def plan(config, head=None, session=None, cluster=None):
+    """
+    Return the Plan to take the keyspace to the given head (or to the
+    last migration on file). resume_from is the number of statements of
+    the first pending migration already applied by an interrupted run.
+    """
+    migrations = get_migrations()
+    with _Connection(config, session, cluster) as session:
+        last = None
+        if keyspace_exists(config['keyspace'], session=session):
+            last = get_last_migration(config, session=session)
+        pending, up = get_pending_migrations(last, migrations, head)
+        resume_from = get_resume_point(config, pending, up, session) if pending and last is not None else 0
+    return Plan(head=last, pending=pending, up=up, resume_from=resume_from)
+
+
+def estimate(config, head=None, throughput=None, session=None, cluster=None):
+    """
+    Return the Plan to the given head and the list of Estimates of each of
+    its statements at the given throughput in partitions per second
+    (CASSANDRA_THROUGHPUT from the settings if not given).
+    """
+    throughput = throughput or config.get('throughput') or DEFAULT_THROUGHPUT
+    with _Connection(config, session, cluster) as session:
+        migrations_plan = plan(config, head, session=session)
+        estimates = estimate_migrations(migrations_plan.pending, migrations_plan.up, config['keyspace'],
+                                        throughput=float(throughput), start=migrations_plan.resume_from,
+                                        session=session)
+    return migrations_plan, estimates
+
+
+def lint(files, sections=('UP', 'DOWN')):
+    """
+    Lint the given sections of the migration files, print the findings and
+    raise LintError if any of them is an error.
+    """
+    findings = lint_migrations(files, sections=sections)
+    for finding in findings:
+        secho(format_finding(finding), fg=('red' if finding.severity == ERROR else 'yellow'))
+    errors = [f for f in findings if f.severity == ERROR]
+    if errors:
+        raise LintError('Migrations have {} lint errors, fix or suppress them before migrating.'.format(len(errors)),
+                        findings=findings)
+    return findings
+
+
+def migrate(config, head=None, session=None, cluster=None, just_demo=False, resume=False,
+            lease_ttl=30, verbose=False, check=True, sample=0, pool_size=0, pool_ttl=3600, snapshot=True,
+            discard_checkpoint=False):
+    """
+    Rehearse the pending migrations in a temporary keyspace and apply them.
+
+    The migrations are applied through a session of their own (opened on the
+    cluster of the given session, if any) because the session keyspace is
+    changed while migrating. With just_demo, only the rehearsal is done.
+    Unless check is False, the pending migrations are linted first.
+    With sample, the rehearsal runs on that many partitions of every table
+    involved (see rehearse). With pool_size, the rehearsal keyspace comes
+    from a pool of up to that many keyspaces evicted after pool_ttl seconds.
+    Unless snapshot is False, the resulting schema becomes the local snapshot.
+    With discard_checkpoint, an interrupted migration is applied again from
+    its first statement instead of being resumed.
+    Progress is only printed when verbose is True.
+    Returns a MigrationResult where delegated tells that another process held
+    the migration lease and did the work and rehearsal has the Timing of
+    each migration in the rehearsal.
+    """
+    if session is not None and cluster is None:
+        cluster = session.cluster
+    with quiet(not verbose):
+        with _Connection(config, cluster=cluster) as session:
+            return _migrate(config, session, head, just_demo, resume, lease_ttl, check, sample,
+                            pool_size, pool_ttl, snapshot, discard_checkpoint)
+
+
+def _migrate(config, session, head, just_demo, resume, lease_ttl, check, sample, pool_size, pool_ttl,
+             snapshot, discard_checkpoint):
+    keyspace = config['keyspace']
+    migrations = get_migrations()
+    # Check if the keyspace exists and if we have a migrations
+    # table configured.
+    if not keyspace_exists(keyspace, session=session):
+        # Keyspace does not exist, we need to create it based on the genesis file.
+        echo('Keyspace not found, creating from the genesis file.')
+        apply_genesis(session)
+        # Override head, it needs to go all the way from the bottom...
+        head = None
+
+    last = get_last_migration(config, session=session)
+    if last is None:
+        result, err = create_migration_table(keyspace, session=session)
+        if not result:
+            raise MigrationError('Unable to continue due to an error:\n\n{}'.format(err), cause=err)
+        if snapshot:
+            update_snapshot(get_current_schema(config), '00000')
+
+    pending, up = get_pending_migrations(last, migrations, head)
+    if not pending:
+        return MigrationResult(head=last, applied=[], up=up, delegated=False, rehearsal=[])
+    if check:
+        # Only the sections that are going to run, an old UP can't block its rollback.
+        lint(pending, sections=('UP' if up else 'DOWN',))
+
+    lease = None
+    if not just_demo:
+        # Only one process migrates the keyspace at a time, the rest
+        # wait until the head moves and leave it as it is.
+        create_lease_table(keyspace, session=session)
+        lease = Lease(keyspace, ttl=lease_ttl, session=session)
+        is_done = lambda: not get_pending_migrations(get_last_migration(config, session=session), migrations, head)[0]
+        if not wait_for_lease(lease, is_done):
+            return MigrationResult(head=get_last_migration(config, session=session), applied=[], up=up,
+                                   delegated=True, rehearsal=[])
+        lease.start_heartbeat()
+    try:
+        # The head could have moved while waiting for the lease.
+        last = get_last_migration(config, session=session)
+        if not last:
+            # The genesis isn't covered by the lease, another process may still be applying it.
+            missing = get_missing_genesis_tables(keyspace, session)
+            if missing:
+                raise MigrationError('The keyspace is missing tables of the genesis migration ({}), it was not '
+                                     'fully applied.'.format(', '.join(missing)), migration='00000.cql')
+        pending, up = get_pending_migrations(last, migrations, head)
+        if not pending:
+            return MigrationResult(head=last, applied=[], up=up, delegated=False, rehearsal=[])
+        # If the first pending migration was interrupted, the keyspace already
+        # contains part of it and we can only continue where it was left.
+        if discard_checkpoint and not just_demo:
+            clear_checkpoint(keyspace, pending[0], session=session)
+        start = get_resume_point(config, pending, up, session) if not discard_checkpoint else 0
+        if start and not resume:
+            raise MigrationError('Migration {} was interrupted after {} statements. Run again with --resume to '
+                                 'continue from there, or with --discard-checkpoint to apply it from its first '
+                                 'statement.'.format(pending[0], start), migration=pending[0])
+        pool = Pool(pool_size, pool_ttl, session=session) if pool_size else None
+        rehearsal = rehearse(config, session, pending, up, start, sample, pool)
+        if just_demo:
+            return MigrationResult(head=last, applied=[], up=up, delegated=False, rehearsal=rehearsal)
+        applied = apply_pending(config, session, pending, up, start, lease, rehearsal, snapshot)
+    finally:
+        if lease is not None:
+            lease.release()
+    return MigrationResult(head=get_last_migration(config, session=session), applied=applied, up=up,
+                           delegated=False, rehearsal=rehearsal)
+
+
+def get_genesis_statements():
+    content = read_migration('00000.cql')
+    statements = get_migration_statements(content, True) if content is not None else None
+    if statements is None:
+        raise MigrationError('Unable to read the genesis migration (00000.cql).', migration='00000.cql')
+    return statements
+
+
+def apply_genesis(session):
+    """
+    Create the keyspace from the genesis migration. Every process that starts
+    on a cluster without the keyspace does it at the same time, so statements
+    that fail because another process created the same thing are skipped.
+    Any other error is raised.
+    """
+    echo('Applying migration 00000.cql UP ', nl=False)
+    for q in get_genesis_statements():
+        try:
+            session.execute(q)
+        except AlreadyExists:
+            continue
+        except InvalidRequest as e:
+            # Indexes and types report it this way.
+            if 'already exist' in str(e):
+                continue
+            secho('ERROR', fg='red', bold=True)
+            raise MigrationError('Unable to continue due to an error in the genesis migration:\n\n{}'.format(e),
+                                 migration='00000.cql', cause=e)
+        except Exception as e:
+            secho('ERROR', fg='red', bold=True)
+            raise MigrationError('Unable to continue due to an error in the genesis migration:\n\n{}'.format(e),
+                                 migration='00000.cql', cause=e)
+    secho('OK', fg='green', bold=True)
+
+
+def get_missing_genesis_tables(keyspace, session):
+    """ Return the tables created by the genesis migration that don't exist in the keyspace. """
+    existing = get_keyspace_tables(keyspace, session=session)
+    missing = []
+    for q in get_genesis_statements():
+        kind, table = get_statement_kind(q)
+        if kind == 'create_table' and table not in existing:
+            missing.append(table)
+    return missing
+
+
+def rehearse(config, session, pending, up, start=0, sample=0, pool=None):
+    """
+    Apply the pending migrations in a temporary copy of the keyspace and
+    return the Timing of each one. If sample is given, that many partitions
+    of every table the migrations work on are copied into the copy first,
+    and the timings are extrapolated to the full size of the tables, whose
+    total is shown before returning. Without sample, the copy is leased from the pool if one is given.
+    """
+    schema = get_current_schema(config)
+    demo = None
+    if pool is not None and not sample:
+        demo = pool.lease(schema, config['keyspace'])
+        if demo is None:
+            echo('The rehearsal keyspace pool is exhausted, using a temporary keyspace.')
+    pooled = demo is not None
+    if not pooled:
+        demo = get_demo_keyspace_name()
+        create_demo_keyspace(schema, config['keyspace'], demo, session=session)
+    timings = []
+    applied = []
+    try:
+        samples = {}
+        if sample:
+            samples = copy_samples(config['keyspace'], demo, get_touched_tables(pending, up), sample,
+                                   session=session)
+        for i, f in enumerate(pending):
+            res, stats = apply_migration(file=f, up=up, keyspace=demo, start=(start if i == 0 else 0),
+                                         session=session)
+            if not res:
+                raise MigrationError('Unable to continue due to an error in {}:\n\n{}'.format(f, stats),
+                                     migration=f, cause=stats)
+            applied.append(f)
+            timing = get_timing(f, stats, samples)
+            if samples:
+                echo('    took {:.2f}s on {:.4%} of the data, projected ~{}'.format(
+                    timing.seconds, timing.fraction, format_seconds(timing.projected)))
+            timings.append(timing)
+        if samples:
+            # Shown before the real migration starts, so it can still be stopped.
+            secho('Projected runtime on the full data: ~{}'.format(
+                format_seconds(sum(t.projected for t in timings))), bold=True)
+    finally:
+        if pooled:
+            # Only a keyspace where every migration was fully applied can be rolled back.
+            return_to_pool(pool, demo, applied, up, clean=(len(applied) == len(pending) and not start))
+        else:
+            delete_demo_keyspace(demo, session=session)
+    return timings
+
+
+def return_to_pool(pool, keyspace, applied, up, clean=True):
+    """
+    Roll back the migrations applied to a pooled keyspace and give it back
+    if it's left exactly as it was leased, or drop it otherwise.
+    """
+    clean = clean and not writes_data(applied)
+    for f in reversed(applied if clean else []):
+        res, err = apply_migration(file=f, up=not up, keyspace=keyspace, session=pool.session)
+        if not res:
+            clean = False
+            break
+    if clean and pool.is_pristine(keyspace):
+        pool.release(keyspace)
+    else:
+        pool.discard(keyspace)
+
+
+def apply_pending(config, session, pending, up, start=0, lease=None, rehearsal=None, snapshot=True):
+    """
+    Apply the pending migrations to the real keyspace and return the applied ones.
+    rehearsal is the list of Timings of the rehearsal, recorded in the history.
+    """
+    keyspace = config['keyspace']
+    result, err = create_checkpoint_table(keyspace, session=session)
+    if not result:
+        raise MigrationError('Unable to continue due to an error:\n\n{}'.format(err), cause=err)
+    upgrade_migration_table(keyspace, session=session)
+    rehearsed = dict((t.migration, t.seconds) for t in rehearsal or [])
+    applied = []
+    for i, f in enumerate(pending):
+        if lease is not None and lease.lost:
+            raise MigrationError('Unable to continue, the migration lease was lost before {}.'.format(f),
+                                 migration=f)
+        res, stats = apply_migration(file=f, up=up, keyspace=keyspace, start=(start if i == 0 else 0),
+                                     checkpoint=keyspace, session=session)
+        if not res:
+            raise MigrationError('Unable to continue due to an error in {}:\n\n{}'.format(f, stats),
+                                 migration=f, cause=stats)
+        record_migration(name=f, schema=get_current_schema(config), up=up, config=config, session=session,
+                         applied=stats, rehearsal=rehearsed.get(f), snapshot=snapshot)
+        # Only now, if the run dies before recording the head, the next one
+        # has to resume after the last statement instead of replaying the file.
+        clear_checkpoint(keyspace, f, session=session)
+        applied.append(f)
+    return applied
+
+
+def history(config, limit=20, slowest=False, migration=None, action=None, min_duration=None,
+            page_size=100, session=None, cluster=None):
+    """
+    Return up to limit HistoryEntries of the applied and rolled back
+    migrations, newest first or slowest first. The history is read page by
+    page and, unless sorting by the slowest, only until limit entries match.
+    """
+    entries = []
+    with _Connection(config, session, cluster) as session:
+        for row in get_history(config['keyspace'], page_size=page_size, session=session):
+            if migration and row.migration != migration:
+                continue
+            if action and row.action != action.upper():
+                continue
+            if min_duration is not None and (row.duration or 0) < min_duration:
+                continue
+            entries.append(HistoryEntry(time=datetime_from_uuid1(row.time), migration=row.migration,
+                                        action=row.action, duration=row.duration, statements=row.statements,
+                                        coordinator=row.coordinator, rehearsal=row.rehearsal))
+            if not slowest and limit and len(entries) >= limit:
+                break
+    if slowest:
+        entries.sort(key=lambda e: e.duration or 0, reverse=True)
+    return entries[:limit] if limit else entries
+
+
+def diff(source, target):
+    """
+    Return the list of statements that take the schema stored for the source
+    head to the one stored for the target head. Heads are migration names or
+    numbers and Cassandra is not involved. Shifter's own tables are ignored.
+    """
+    schemas = []
+    for head in (source, target):
+        schema = get_stored_snapshot(head)
+        if schema is None:
+            raise ShifterError('No schema snapshot stored for {}. Stored: {}.'.format(
+                head, ', '.join(get_stored_migrations()) or 'none'))
+        keyspace = parse_schema(schema)
+        keyspace.tables = [t for t in keyspace.tables if t.name not in SHIFTER_TABLES]
+        schemas.append(keyspace)
+    return get_keyspace_diff(*schemas)
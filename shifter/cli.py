@@ -1,21 +1,51 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, division, print_function, unicode_literals
+import sys
 import click
 import warnings
 
+from . import api
 from .migrate import create_migration_file, create_init_migration, get_migrations_on_file
-from .migrate import get_last_migration, get_pending_migrations, apply_migration
-from .db import connect, get_current_schema, create_demo_keyspace, keyspace_exists
-from .db import record_migration, delete_demo_keyspace, create_migration_table, DEMO_KEYSPACE
-from .db import auto_migrate_keyspace, get_snapshot, update_snapshot
+from .migrate import get_last_migration, get_pending_migrations
+from .db import connect, get_session, get_current_schema, create_demo_keyspace, keyspace_exists
+from .db import record_migration, delete_demo_keyspace, upgrade_migration_table
+from .db import auto_migrate_keyspace, get_snapshot, get_demo_keyspace_name
+from .estimate import format_estimate, format_bytes, format_seconds, DEFAULT_THROUGHPUT
+from .pool import Pool
+from .watch import Watcher
+from .serve import serve as serve_status
+from .fanout import load_waves, fan_out, MIGRATED, FAILED, SKIPPED
 from .config import get_config
+from .exceptions import ShifterError
 
 warnings.filterwarnings("ignore")
 
-# Get configuration
-config = get_config()
 
-@click.group()
+class ShifterGroup(click.Group):
+    """ Report shifter errors and exit instead of showing a traceback. """
+    def invoke(self, ctx):
+        try:
+            return super(ShifterGroup, self).invoke(ctx)
+        except ShifterError as e:
+            click.secho('---\n{}\n---\n'.format(e), fg='red')
+            sys.exit(1)
+
+
+# Configuration, loaded by the commands that need it.
+config = None
+
+
+def load_config(settings=None):
+    """ Return the configuration of the given settings module, or of the environment. """
+    global config
+    if settings is not None:
+        config = get_config({'CASSANDRA_SETTINGS': settings})
+    elif config is None:
+        config = get_config()
+    return config
+
+
+@click.group(cls=ShifterGroup)
 def cli():
     pass
 
@@ -36,7 +66,7 @@ def create(name, title, description):
 @cli.command('init', short_help='Create the migration genesis based on the current keyspace.')
 def init():
     """ Initiate the migration project in the current directory. """
-    global config
+    config = load_config()
     # Cassandra connection.
     connect(config)
     create_init_migration(config)
@@ -46,38 +76,23 @@ def init():
 @click.option('--settings', default=None, help='Settings module (not file). Must contain CASSANDRA_SEEDS and CASSANDRA_KEYSPACE defined')
 def status(settings):
     """ Get the current migration status. """
-    global config
-    if settings is not None:
-        config = get_config({'CASSANDRA_SETTINGS': settings})
-    # Cassandra connection.
-    connect(config)
-    # Check migrations on file.
-    migrations = get_migrations_on_file()
-    if not migrations:
-        click.secho('No migrations found on the current directory.')
-        return
-    if '00000.cql' not in migrations:
-        click.secho('There is no genesis migration found.')
-        return
-    if not keyspace_exists(config.get('keyspace')):
+    config = load_config(settings)
+    current = api.status(config)
+    if not current.initialized:
         click.echo('Shift hasn\'t been initialized on this keyspace.\nRun \'shift migrate\' to initiate or user the --help flag.')
         return
-    last = get_last_migration(config)
-    if last is None:
-        click.secho('Shift hasn\'t been initialized in this keyspace.')
-        return
-    pending, up = get_pending_migrations(last, migrations)
-    if len(pending) <= 0:
-        click.echo("Already up to date.\nCurrent head is {}".format(last))
+    if len(current.pending) <= 0:
+        click.echo("Already up to date.\nCurrent head is {}".format(current.head))
         return
-    click.echo("Cassandra is {} movements behind the current file head ({}).\nCurrent Cassandra head is {}".format(len(pending), migrations[-1], last))
+    click.echo("Cassandra is {} movements behind the current file head ({}).\nCurrent Cassandra head is {}".format(
+        len(current.pending), current.file_head, current.head))
 
 
 @cli.command('auto-update', short_help='Auto generate the next migration targeting the current Cassandra structure.')
 @click.option('--print', is_flag=True, help='Just print the migrations')
 @click.option('--name', required=True, help='Name of the update')
 def auto_update(print, name):
-    global config
+    config = load_config()
     # Cassandra connection.
     connect(config)
     # Check migrations on file.
@@ -98,14 +113,15 @@ def auto_update(print, name):
     if not snap:
         click.secho('Unable to locate the last snapshot.', fg='red')
         return
-    create_demo_keyspace(snap, config.get('keyspace'))
-    actions_up = auto_migrate_keyspace(DEMO_KEYSPACE, config.get('keyspace'))
+    demo = get_demo_keyspace_name()
+    create_demo_keyspace(snap, config.get('keyspace'), demo)
+    actions_up = auto_migrate_keyspace(demo, config.get('keyspace'))
     if len(actions_up) <= 0:
         click.secho('Cassandra is up to date with migrations on file.')
-        delete_demo_keyspace()
+        delete_demo_keyspace(demo)
         return
-    actions_down = auto_migrate_keyspace(config.get('keyspace'), DEMO_KEYSPACE)
-    delete_demo_keyspace()
+    actions_down = auto_migrate_keyspace(config.get('keyspace'), demo)
+    delete_demo_keyspace(demo)
     upquery = ';\n'.join(actions_up) + ";"
     downquery = ';\n'.join(actions_down)  + ";"
     if print:
@@ -113,93 +129,216 @@ def auto_update(print, name):
         return
     file = create_migration_file(name, upquery, downquery)
     click.echo('Created migration file ', nl=False)
+    upgrade_migration_table(config['keyspace'])
     record_migration(file, get_current_schema(config), config)
     click.secho(file, bold=True, fg='green')
 
 
+@cli.command('diff', short_help='Show the schema changes between two migrations.')
+@click.argument('source', required=True)
+@click.argument('target', required=True)
+def diff(source, target):
+    """
+    Print the statements that take the schema of the SOURCE migration to the
+    one of the TARGET migration, from the local snapshot store.
+    """
+    actions = api.diff(source, target)
+    if not actions:
+        click.echo('No schema changes between {} and {}.'.format(source, target))
+        return
+    click.echo('---\n' + ';\n'.join(actions) + ';\n---')
+
+
+@cli.command('lint', short_help='Check migration files for performance hazards.')
+@click.argument('files', nargs=-1)
+def lint(files):
+    """
+    Lint the given migration files (all but the genesis if none given)
+    against the last snapshot of the schema.
+    """
+    if not files:
+        files = [f for f in get_migrations_on_file() if f != '00000.cql']
+    findings = api.lint(files)
+    if not findings:
+        click.secho('No issues found.', fg='green')
+
+
 @cli.command('migrate', short_help='Migrate the current database.')
 @click.argument('head', required=False)
 @click.option('--simulate', is_flag=True, help='Just print the migrations that will be performed')
 @click.option('--just-demo', is_flag=True, help='Just perform the migrations in demo DB')
+@click.option('--resume', is_flag=True, help='Resume an interrupted migration from the first statement not yet executed')
+@click.option('--discard-checkpoint', is_flag=True, help='Forget the progress of an interrupted migration and apply it from its first statement')
+@click.option('--lease-ttl', default=30, help='Seconds the migration lease survives without a heartbeat')
+@click.option('--skip-lint', is_flag=True, help='Do not lint the pending migrations before migrating')
+@click.option('--throughput', default=None, type=float, help='Partitions per second used by --simulate to project runtimes')
+@click.option('--sample', default=0, help='Rehearse on this many partitions copied from every table involved')
+@click.option('--pool', is_flag=True, help='Lease the demo keyspace from the shared rehearsal keyspace pool')
+@click.option('--pool-size', default=8, help='Maximum number of keyspaces in the rehearsal pool')
+@click.option('--pool-ttl', default=3600, help='Seconds after which an unused pooled keyspace is evicted')
 @click.option('--settings', default=None, help='Settings module (not file). Must contain CASSANDRA_SEEDS and CASSANDRA_KEYSPACE defined')
-def migrate(head, simulate, just_demo, settings):
+def migrate(head, simulate, just_demo, resume, discard_checkpoint, lease_ttl, skip_lint, throughput, sample, pool, pool_size, pool_ttl,
+            settings):
     """ Migrate now. """
-    global config
-    if settings is not None:
-        config = get_config({'CASSANDRA_SETTINGS': settings})
+    config = load_config(settings)
     # Input validation.
     try:
         head = int(head) if head else None
     except Exception:
         click.secho('Head argument must be an integer.', fg='red')
         return
-    # Cassandra connection.
-    connect(config)
-    # Check migrations on file.
-    migrations = get_migrations_on_file()
-    # Check if there is the migration genesis is present
-    # if it's not present we cannot continue.
-    if '00000.cql' not in migrations:
-        click.secho('Migration genesis (00000.cql) is missing! Forgot to run init command first?', fg='red')
-        return
-    # Check if the keyspace exists and if we have a migrations
-    # table configured.
-    if not keyspace_exists(config.get('keyspace')):
-        # Keyspace does not exist, we need to create it based on the genesis file.
-        click.echo('Keyspace not found, creating from the genesis file.')
-        result, err = apply_migration('00000.cql', True, None)
-        if not result:
-            click.secho('---\nUnable to continue due to an error genesis migration:\n\n{}\n---\n'.format(err.message), fg='red')
-            return
-        # Override head, it needs to go all the way from the bottom...
-        head = None
 
-    schema = get_current_schema(config)
-    last = get_last_migration(config)
-    if last is None:
-        result, err = create_migration_table(config.get('keyspace'))
-        if not result:
-            click.secho('---\nUnable to continue due to an error:\n\n{}\n---\n'.format(err.message), fg='red')
+    if simulate:
+        plan, estimates = api.estimate(config, head, throughput)
+        if not plan.pending:
+            click.echo("Already up to date.")
             return
-        update_snapshot(get_current_schema(config))
-
-    if len(migrations) <= 0:
-        create_init_migration(config)
-    pending, up = get_pending_migrations(last, migrations, head)
-    if len(pending) <= 0:
-        click.echo("Already up to date.")
+        for p in plan.pending:
+            click.echo('{} will be applied {}'.format(p, 'UP' if plan.up else 'DOWN'), nl=False)
+            if p == plan.pending[0] and plan.resume_from:
+                click.echo(' (resuming after {} statements)'.format(plan.resume_from), nl=False)
+            click.echo()
+            for e in estimates:
+                if e.migration == p:
+                    click.secho('    ' + format_estimate(e), fg=('yellow' if e.schema_change else None))
+        click.secho('Projected: ~{} partitions, {}, ~{} at {} partitions/s'.format(
+            sum(e.partitions for e in estimates), format_bytes(sum(e.bytes for e in estimates)),
+            format_seconds(sum(e.seconds for e in estimates)),
+            int(throughput or config.get('throughput') or DEFAULT_THROUGHPUT)), bold=True)
         return
 
-    if simulate:
-        for p in pending:
-            click.echo('{} will be applied {}'.format(p, 'UP' if up else 'DOWN'))
+    result = api.migrate(config, head, just_demo=just_demo, resume=resume, lease_ttl=lease_ttl, verbose=True,
+                         check=not skip_lint, sample=sample, pool_size=(pool_size if pool else 0),
+                         pool_ttl=pool_ttl, discard_checkpoint=discard_checkpoint)
+    if result.delegated:
+        click.echo("Migration completed by another process.")
+    elif just_demo:
         return
+    elif not result.applied:
+        click.echo("Already up to date.")
+    else:
+        click.echo("Migration completed successfully.")
 
-    # First in demo
-    error = False
-    create_demo_keyspace(schema, config['keyspace'])
-    for f in pending:
-        res, err = apply_migration(file=f, up=up, keyspace=DEMO_KEYSPACE)
-        if not res:
-            error = True
-            click.secho('---\nUnable to continue due to an error in {}:\n\n{}\n---\n'.format(f, err), fg='red')
-            break
-    delete_demo_keyspace()
-    if error:
+
+@cli.command('deploy', short_help='Migrate several clusters concurrently, in waves.')
+@click.argument('head', required=False)
+@click.option('--wave', 'waves', multiple=True, required=True,
+              help='Comma separated settings modules migrated concurrently. Repeat for every wave, in order')
+@click.option('--just-demo', is_flag=True, help='Just perform the migrations in demo DB')
+@click.option('--resume', is_flag=True, help='Resume an interrupted migration from the first statement not yet executed')
+@click.option('--lease-ttl', default=30, help='Seconds the migration lease survives without a heartbeat')
+@click.option('--skip-lint', is_flag=True, help='Do not lint the pending migrations before migrating')
+@click.option('--max-workers', default=None, type=int, help='Maximum number of clusters migrated at the same time')
+def deploy(head, waves, just_demo, resume, lease_ttl, skip_lint, max_workers):
+    """
+    Migrate every cluster of a wave concurrently, each one with its own
+    settings module, and only start the next wave if all of them succeeded.
+
+    \b
+        shifter deploy --wave settings.staging --wave settings.us,settings.eu
+    """
+    try:
+        head = int(head) if head else None
+    except Exception:
+        click.secho('Head argument must be an integer.', fg='red')
         return
-    if just_demo:
+    waves = load_waves([[s.strip() for s in w.split(',') if s.strip()] for w in waves])
+    outcomes = fan_out([w for w in waves if w], head, max_workers, just_demo=just_demo, resume=resume,
+                       lease_ttl=lease_ttl, check=not skip_lint)
+
+    click.secho('\n{:<5} {:<30} {:<20} {:<11} {:>8}  {}'.format(
+        'WAVE', 'SETTINGS', 'KEYSPACE', 'STATE', 'TIME', 'HEAD'), bold=True)
+    colors = {MIGRATED: 'green', FAILED: 'red', SKIPPED: 'yellow'}
+    for o in outcomes:
+        click.secho('{:<5} {:<30} {:<20} {:<11} {:>8}  {}'.format(
+            o.wave, o.settings, o.keyspace, o.state, '{:.1f}s'.format(o.seconds) if o.state != SKIPPED else '-',
+            (o.result.head or '-') if o.result else '-'), fg=colors.get(o.state))
+    failed = [o for o in outcomes if o.state == FAILED]
+    for o in failed:
+        click.secho('\n{} ({}):\n{}'.format(o.settings, o.keyspace, o.error), fg='red')
+    if failed:
+        raise ShifterError('Deploy failed on {} of {} clusters.'.format(len(failed), len(outcomes)))
+
+
+@cli.command('watch', short_help='Keep a demo keyspace in sync with the migration files as they are edited.')
+@click.option('--interval', default=0.5, help='Seconds between checks of the migrations directory')
+@click.option('--settings', default=None, help='Settings module (not file). Must contain CASSANDRA_SEEDS and CASSANDRA_KEYSPACE defined')
+def watch(interval, settings):
+    """
+    Apply the pending migrations to a demo keyspace and apply them again,
+    rolling back the previous version first, every time a file changes.
+    """
+    config = load_config(settings)
+    connect(config)
+    Watcher(config).watch(interval)
+
+
+@cli.command('serve', short_help='Serve the migration status over HTTP for probes and dashboards.')
+@click.option('--host', default='127.0.0.1', help='Address to listen on')
+@click.option('--port', default=8500, help='Port to listen on')
+@click.option('--ttl', default=30, help='Seconds the status is cached for if the schema does not change')
+@click.option('--settings', default=None, help='Settings module (not file). Must contain CASSANDRA_SEEDS and CASSANDRA_KEYSPACE defined')
+def serve(host, port, ttl, settings):
+    """
+    Serve GET /status (the status as JSON) and GET /ready (503 while
+    there are pending migrations) keeping a single connection to Cassandra.
+    """
+    config = load_config(settings)
+    connect(config)
+    click.echo('Serving the status of {} on http://{}:{}/status'.format(config['keyspace'], host, port))
+    serve_status(config, host, port, ttl)
+
+
+@cli.command('history', short_help='Show the migrations applied and rolled back, with their durations.')
+@click.option('--limit', default=20, help='Maximum number of entries to show (0 for all)')
+@click.option('--slowest', is_flag=True, help='Sort by duration, slowest first')
+@click.option('--migration', default=None, help='Only show this migration')
+@click.option('--action', default=None, type=click.Choice(['up', 'down']), help='Only show applies or rollbacks')
+@click.option('--min-duration', default=None, type=float, help='Only show migrations that took at least this many seconds')
+@click.option('--settings', default=None, help='Settings module (not file). Must contain CASSANDRA_SEEDS and CASSANDRA_KEYSPACE defined')
+def history(limit, slowest, migration, action, min_duration, settings):
+    """ Show the history of migrations of the keyspace. """
+    config = load_config(settings)
+    entries = api.history(config, limit=limit, slowest=slowest, migration=migration, action=action,
+                          min_duration=min_duration)
+    if not entries:
+        click.echo('No migrations recorded yet.')
         return
-    # Now in real keyspace
-    for f in pending:
-        res, err = apply_migration(file=f, up=up, keyspace=config['keyspace'])
-        if not res:
-            error = True
-            click.secho('---\nUnable to continue due to an error in {}:\n\n{}\n---\n'.format(f, err.message), fg='red')
-            break
-        record_migration(name=f, schema=get_current_schema(config), up=up, config=config)
-    if error:
+    click.secho('{:<20} {:<40} {:<5} {:>10} {:>10} {:>10}  {}'.format(
+        'TIME', 'MIGRATION', 'DIR', 'DURATION', 'REHEARSAL', 'STATEMENTS', 'COORDINATOR'), bold=True)
+    for e in entries:
+        click.echo('{:<20} {:<40} {:<5} {:>10} {:>10} {:>10}  {}'.format(
+            e.time.strftime('%Y-%m-%d %H:%M:%S'), e.migration, e.action or '',
+            '{:.2f}s'.format(e.duration) if e.duration is not None else '-',
+            '{:.2f}s'.format(e.rehearsal) if e.rehearsal is not None else '-',
+            e.statements if e.statements is not None else '-', e.coordinator or '-'))
+
+
+@cli.group('pool', short_help='Manage the shared pool of rehearsal keyspaces.')
+def pool():
+    pass
+
+
+@pool.command('list', short_help='List the pooled rehearsal keyspaces.')
+def pool_list():
+    connect(load_config())
+    entries = Pool(session=get_session()).entries()
+    if not entries:
+        click.echo('The rehearsal keyspace pool is empty.')
         return
-    click.echo("Migration completed successfully.")
+    for e in entries:
+        click.echo('{:<24} {:<7} {:<34} {}'.format(
+            e.name, e.state, e.fingerprint or '-',
+            (e.leased if e.state == 'leased' else e.used) or '-'))
+
+
+@pool.command('cleanup', short_help='Evict stale (or all) pooled rehearsal keyspaces.')
+@click.option('--ttl', default=3600, help='Seconds after which an unused or abandoned keyspace is evicted')
+@click.option('--all', 'everything', is_flag=True, help='Evict every pooled keyspace, even the leased ones')
+def pool_cleanup(ttl, everything):
+    connect(load_config())
+    remaining = Pool(ttl=ttl, session=get_session()).evict(everything=everything)
+    click.echo('{} keyspaces left in the pool.'.format(len(remaining)))
 
 
 if __name__ == "__main__":
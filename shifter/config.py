@@ -1,10 +1,10 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, division, print_function, unicode_literals
 import os
-import sys
-import click
 import importlib
 
+from .exceptions import SettingsError
+
 REQUIRED = [
     'CASSANDRA_SEEDS',
     'CASSANDRA_KEYSPACE'
@@ -13,7 +13,8 @@ OPTIONAL = [
     'CASSANDRA_PORT',
     'CASSANDRA_USER',
     'CASSANDRA_PASSWORD',
-    'CASSANDRA_CQLVERSION'
+    'CASSANDRA_CQLVERSION',
+    'CASSANDRA_THROUGHPUT'
 ]
 
 
@@ -21,16 +22,22 @@ def get_config(env_override=None):
     """ Get the configuration dict. """
     env = os.environ
     if env_override is not None:
-        for key, value in env_override.iteritems():
+        for key, value in env_override.items():
             env[key] = value
+    return load_config(env.get('CASSANDRA_SETTINGS'))
+
 
+def load_config(module):
+    """
+    Get the configuration dict of the given settings module without
+    touching the environment, so several of them can be used at once.
+    """
     settings = None
     try:
-        if 'CASSANDRA_SETTINGS' in os.environ:
-            settings = importlib.import_module(env['CASSANDRA_SETTINGS'])
+        if module is not None:
+            settings = importlib.import_module(module)
     except Exception:
-        click.secho('Unable to load settings module {}!'.format(env.get('CASSANDRA_SETTINGS')), fg='red')
-        sys.exit()
+        raise SettingsError('Unable to load settings module {}!'.format(module))
 
     # Check configuration
     config = {}
@@ -39,8 +46,7 @@ def get_config(env_override=None):
         if hasattr(settings, c):
             config[c.lower().split('_', 1).pop()] = getattr(settings, c)
         else:
-            click.secho('{} is missing is settings file!'.format(c), fg='red')
-            sys.exit()
+            raise SettingsError('{} is missing is settings file!'.format(c))
     for c in OPTIONAL:
         if hasattr(settings, c):
             config[c.lower().split('_', 1).pop()] = getattr(settings, c)
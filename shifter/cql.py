@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+import re
+from collections import namedtuple
+
+from .map import Column, Table, Keyspace
+
+
+Statement = namedtuple('Statement', ['text', 'line', 'section'])
+
+COMMENT_RE = re.compile(r'/\*.*?\*/|--[^\n]*', re.S)
+BATCH_START_RE = re.compile(r'^BEGIN\s+(UNLOGGED\s+|COUNTER\s+)?BATCH\b', re.I)
+BATCH_END_RE = re.compile(r'\bAPPLY\s+BATCH\s*$', re.I)
+WHERE_RE = re.compile(r'\bWHERE\b(.*?)(?:\bLIMIT\b|\bORDER\s+BY\b|\bALLOW\s+FILTERING\b|\bIF\b|$)', re.I | re.S)
+RESTRICTION_RE = re.compile(r'\s*([\w"]+)\s*(?:=\s*|\bIN\s*\((.*)\))', re.I | re.S)
+TABLE_RES = [
+    ('create_table', re.compile(r'^CREATE\s+(?:TABLE|COLUMNFAMILY)\s+(?:IF\s+NOT\s+EXISTS\s+)?([\w."]+)', re.I)),
+    ('alter_table', re.compile(r'^ALTER\s+(?:TABLE|COLUMNFAMILY)\s+([\w."]+)', re.I)),
+    ('drop_table', re.compile(r'^DROP\s+(?:TABLE|COLUMNFAMILY)\s+(?:IF\s+EXISTS\s+)?([\w."]+)', re.I)),
+    ('truncate', re.compile(r'^TRUNCATE\s+(?:TABLE\s+)?([\w."]+)', re.I)),
+    ('create_index', re.compile(r'^CREATE\s+(?:CUSTOM\s+)?INDEX\s+(?:IF\s+NOT\s+EXISTS\s+)?(?:[\w"]+\s+)?ON\s+([\w."]+)', re.I)),
+    ('insert', re.compile(r'^INSERT\s+INTO\s+([\w."]+)', re.I)),
+    ('update', re.compile(r'^UPDATE\s+([\w."]+)', re.I)),
+    ('delete', re.compile(r'^DELETE\s+.*?\bFROM\s+([\w."]+)', re.I | re.S)),
+    ('select', re.compile(r'^SELECT\s+.*?\bFROM\s+([\w."]+)', re.I | re.S)),
+    ('batch', BATCH_START_RE),
+]
+
+
+def strip_comments(text):
+    return COMMENT_RE.sub(' ', text)
+
+
+def get_sections(content):
+    """
+    Split the content of a migration file the same way apply_migration does.
+    Return a list of (section, text, first_line) where section is 'UP' or 'DOWN'.
+    """
+    up_at = content.find('--UP--')
+    start = 0 if up_at < 0 else up_at + len('--UP--')
+    down_at = content.find('--DOWN--', start)
+    sections = []
+    if down_at < 0:
+        sections.append(('UP', content[start:], content.count('\n', 0, start) + 1))
+    else:
+        sections.append(('UP', content[start:down_at], content.count('\n', 0, start) + 1))
+        end = down_at + len('--DOWN--')
+        sections.append(('DOWN', content[end:], content.count('\n', 0, end) + 1))
+    return sections
+
+
+def split_statements(text, line=1, section='UP'):
+    """
+    Split the text in ; separated statements keeping the line in which
+    each one starts. Comments stay in the statement they precede.
+    """
+    statements = []
+    offset = 0
+    for chunk in text.split(';'):
+        if strip_comments(chunk).strip() != '':
+            # The statement starts at its first non blank, non comment character.
+            code = COMMENT_RE.sub(lambda m: re.sub(r'\S', ' ', m.group(0)), chunk)
+            first = len(code) - len(code.lstrip())
+            statements.append(Statement(
+                text=chunk.strip(),
+                line=line + text.count('\n', 0, offset + first),
+                section=section))
+        offset += len(chunk) + 1
+    return join_batches(statements)
+
+
+def join_batches(statements):
+    """ Put back together the statements of a BEGIN BATCH ... APPLY BATCH block. """
+    joined = []
+    batch = None
+    for s in statements:
+        code = strip_comments(s.text if isinstance(s, Statement) else s).strip()
+        if batch is None and BATCH_START_RE.match(code) and not BATCH_END_RE.search(code):
+            batch = [s]
+            continue
+        if batch is not None:
+            batch.append(s)
+            if not BATCH_END_RE.search(code):
+                continue
+            s = _join(batch)
+            batch = None
+        joined.append(s)
+    if batch is not None:
+        joined.append(_join(batch))
+    return joined
+
+
+def _join(statements):
+    if isinstance(statements[0], Statement):
+        return statements[0]._replace(text='; '.join(s.text for s in statements))
+    return '; '.join(statements)
+
+
+def get_statement_kind(text):
+    """
+    Return (kind, table) of the statement where table is the unqualified
+    name of the table it works on, or None.
+    """
+    code = strip_comments(text).strip()
+    for kind, regex in TABLE_RES:
+        m = regex.match(code)
+        if m:
+            table = m.group(1) if kind != 'batch' else None
+            return (kind, unquote(table.split('.')[-1]) if table else None)
+    return (None, None)
+
+
+def get_restrictions(code):
+    """
+    Return a dict of the columns restricted by = or IN in the WHERE clause
+    of the statement with the number of values they are restricted to.
+    If the statement has no WHERE clause, None is returned.
+    """
+    m = WHERE_RE.search(code)
+    if not m:
+        return None
+    restrictions = {}
+    for condition in re.split(r'\bAND\b', m.group(1), flags=re.I):
+        c = RESTRICTION_RE.match(condition)
+        if c:
+            restrictions[unquote(c.group(1))] = len(split_top_level(c.group(2))) if c.group(2) else 1
+    return restrictions
+
+
+def unquote(name):
+    if name.startswith('"') and name.endswith('"'):
+        return name[1:-1]
+    return name.lower()
+
+
+def split_top_level(text, separator=','):
+    """ Split by separator ignoring the ones inside (), <> or {}. """
+    parts = []
+    depth = 0
+    current = []
+    for c in text:
+        if c in '(<{':
+            depth += 1
+        elif c in ')>}':
+            depth -= 1
+        if c == separator and depth == 0:
+            parts.append(''.join(current))
+            current = []
+            continue
+        current.append(c)
+    parts.append(''.join(current))
+    return [p.strip() for p in parts if p.strip()]
+
+
+def parse_table(statement):
+    """ Build a map.Table from a CREATE TABLE statement, or None if it isn't one. """
+    kind, name = get_statement_kind(statement)
+    if kind != 'create_table':
+        return None
+    code = strip_comments(statement)
+    start = code.index('(')
+    depth = 0
+    for end in range(start, len(code)):
+        if code[end] == '(':
+            depth += 1
+        elif code[end] == ')':
+            depth -= 1
+            if depth == 0:
+                break
+    body = code[start + 1:end]
+    options = code[end + 1:]
+
+    columns = []
+    partition = []
+    clustering = []
+    for item in split_top_level(body):
+        m = re.match(r'^PRIMARY\s+KEY\s*\((.*)\)$', item, re.I | re.S)
+        if m:
+            keys = split_top_level(m.group(1))
+            if keys and keys[0].startswith('('):
+                partition = split_top_level(keys[0][1:-1])
+            else:
+                partition = keys[:1]
+            clustering = keys[1:]
+            continue
+        column, type = item.split(None, 1)
+        m = re.match(r'^(.*?)\s*((?:STATIC|PRIMARY\s+KEY)(?:\s.*)?)?$', type, re.I | re.S)
+        type, flags = m.group(1), (m.group(2) or '').upper()
+        if 'PRIMARY' in flags:
+            partition = [column]
+        columns.append(Column(name=unquote(column), type=normalize_type(type),
+                              kind=('static' if 'STATIC' in flags else 'regular')))
+
+    orders = {}
+    m = re.search(r'CLUSTERING\s+ORDER\s+BY\s*\(([^)]*)\)', options, re.I)
+    if m:
+        for item in split_top_level(m.group(1)):
+            parts = item.split()
+            orders[unquote(parts[0])] = parts[1].lower() if len(parts) > 1 else 'asc'
+    partition = [unquote(c) for c in partition]
+    clustering = [unquote(c) for c in clustering]
+    for col in columns:
+        if col.name in partition:
+            col.kind, col.position, col.order = 'partition_key', partition.index(col.name), 'none'
+        elif col.name in clustering:
+            col.kind, col.position = 'clustering', clustering.index(col.name)
+            col.order = orders.get(col.name, 'asc')
+        else:
+            col.order = 'none'
+    return Table(name=name, columns=columns)
+
+
+def normalize_type(type):
+    type = re.sub(r'\s+', '', type.lower())
+    return type.replace(',', ', ')
+
+
+def parse_schema(schema, name=None):
+    """
+    Build a map.Keyspace from a schema as dumped by cqlsh DESCRIBE KEYSPACE.
+    Only tables are taken into account.
+    """
+    keyspace = Keyspace(name=name, tables=[])
+    for statement in split_statements(schema):
+        table = parse_table(statement.text)
+        if table is not None:
+            keyspace.tables.append(table)
+    return keyspace
@@ -1,48 +1,70 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, division, print_function, unicode_literals
-import sys
 import time
 import hashlib
 import copy
+import uuid
+import threading
 
-import click
+import six
 from invoke import run
 from cassandra.cluster import Cluster
+from cassandra.query import SimpleStatement
 from cassandra.util import max_uuid_from_time
 from cassandra.auth import PlainTextAuthProvider
 
 from .map import Column, Table, Keyspace
+from .map import get_columns_diff, get_tables_diff, get_keyspace_diff
+from .store import store_snapshot, write_file
+from .output import echo, secho
+from .exceptions import ShifterError, ConnectError
 
 
 DEMO_KEYSPACE = 'cm_tmp'
 SHIFT_TABLE = 'shift_migrations'
+CHECKPOINT_TABLE = 'shift_checkpoints'
+HISTORY_COLUMNS = [
+    ('action', 'text'),
+    ('duration', 'double'),
+    ('statements', 'int'),
+    ('coordinator', 'text'),
+    ('rehearsal', 'double'),
+]
 
 session = None
+snapshot_lock = threading.Lock()
 
 
-def connect(config):
-    global session
-    # Connect to cassandra
+def get_cluster(config):
+    """ Return a new (not yet connected) cluster for the given configuration. """
     auth_provider = None
     if config.get('user'):
         auth_provider = PlainTextAuthProvider(username=config.get('user'), password=config.get('password'))
-    cluster = Cluster(
+    return Cluster(
         contact_points=config.get('seeds'),
         port=(int(config.get('port')) if config.get('port') else 9042),
         auth_provider=auth_provider
     )
+
+
+def open_session(cluster):
+    """ Connect the cluster and return a new session. """
     try:
-        session = cluster.connect()
-    except:
-        click.secho("Unable to connect to Cassandra", fg='red')
-        sys.exit()
+        return cluster.connect()
+    except Exception as e:
+        raise ConnectError("Unable to connect to Cassandra: {}".format(e))
+
+
+def connect(config):
+    """ Connect to cassandra and make the session the module default. """
+    global session
+    session = open_session(get_cluster(config))
     return session
 
 
 def get_session():
-    global session
     if session is None:
-        connect()
+        raise ConnectError("Not connected to Cassandra")
     return session
 
 
@@ -56,11 +78,17 @@ def get_snapshot():
     return content
 
 
-def update_snapshot(schema):
+def update_snapshot(schema, migration=None):
+    """
+    Make the schema the last snapshot. If migration is given, the schema is
+    also kept in the snapshot store as the one of that migration. Writes are
+    atomic and serialized, several threads may be migrating at once.
+    """
     try:
-        file = open('migrations/.snapshot', 'w+')
-        file.write(schema)
-        file.close()
+        with snapshot_lock:
+            write_file('migrations/.snapshot', schema.encode('utf-8') if isinstance(schema, six.text_type) else schema)
+            if migration is not None:
+                store_snapshot(migration, schema)
     except Exception:
         pass
 
@@ -89,129 +117,254 @@ def get_current_schema(config):
         cqlsh = run_cqlsh(config, command="DESCRIBE " + config['keyspace'])
         out = run(cqlsh, hide='stdout')
     except Exception as e:
-        click.secho("Unable to get the current DB schema: {}".format(e), fg='red')
-        sys.exit()
+        raise ShifterError("Unable to get the current DB schema: {}".format(e))
     return out.stdout
 
 
-def create_demo_keyspace(schema, schema_name):
-    schema = schema.replace("CREATE KEYSPACE {}".format(schema_name), "CREATE KEYSPACE {}".format(DEMO_KEYSPACE), 1)
-    schema = schema.replace("{}.".format(schema_name), "{}.".format(DEMO_KEYSPACE))
+def get_demo_keyspace_name():
+    """ Return a demo keyspace name that is unique to this run. """
+    return '{}_{}'.format(DEMO_KEYSPACE, uuid.uuid4().hex[:12])
+
+
+def create_demo_keyspace(schema, schema_name, keyspace=DEMO_KEYSPACE, session=None):
+    session = session or get_session()
+    schema = schema.replace("CREATE KEYSPACE {}".format(schema_name), "CREATE KEYSPACE {}".format(keyspace), 1)
+    schema = schema.replace("{}.".format(schema_name), "{}.".format(keyspace))
     try:
-        click.echo("Creating tmp keyspace... ", nl=False)
-        session.execute("DROP KEYSPACE IF EXISTS {}".format(DEMO_KEYSPACE))
+        echo("Creating tmp keyspace... ", nl=False)
+        session.execute("DROP KEYSPACE IF EXISTS {}".format(keyspace))
         for q in schema.replace('\n', '').split(';'):
             if q.strip() == "":
                 continue
             session.execute(q)
     except Exception as e:
-        click.secho("ERROR {}".format(e), fg='red', bold=True)
-        sys.exit()
-    click.secho("OK", fg='green', bold=True)
+        secho("ERROR", fg='red', bold=True)
+        raise ShifterError("Unable to create the tmp keyspace: {}".format(e))
+    secho("OK", fg='green', bold=True)
 
 
-def delete_demo_keyspace():
+def delete_demo_keyspace(keyspace=DEMO_KEYSPACE, session=None):
+    session = session or get_session()
     try:
-        click.echo("Deleting tmp keyspace... ", nl=False)
-        session.execute("DROP KEYSPACE IF EXISTS {}".format(DEMO_KEYSPACE))
-        click.secho("OK", fg='green', bold=True)
+        echo("Deleting tmp keyspace... ", nl=False)
+        session.execute("DROP KEYSPACE IF EXISTS {}".format(keyspace))
+        secho("OK", fg='green', bold=True)
     except Exception:
-        click.secho("ERROR", fg='red', bold=True)
+        secho("ERROR", fg='red', bold=True)
 
 
-def record_migration(name, schema, config, up=True):
-    session.set_keyspace(config['keyspace'])
+def record_migration(name, schema, config, up=True, session=None, applied=None, rehearsal=None, snapshot=True):
+    """
+    Record the migration as the new head (or remove it when going down)
+    and add it to the history along with how it went: applied is the
+    migrate.Applied of the real run and rehearsal the seconds it took in
+    the rehearsal keyspace, if known. Unless snapshot is False, the schema
+    becomes the local snapshot.
+    """
+    session = session or get_session()
+    keyspace = config['keyspace']
     if name.endswith('.cql'):
         name = name[:-4]
+    m = hashlib.md5()
+    m.update(schema.encode('utf-8') if isinstance(schema, six.text_type) else schema)
+    session.execute(
+        """
+        INSERT INTO {}.shift_migrations(type, time, migration, hash, action, duration, statements,
+                                        coordinator, rehearsal)
+        VALUES ('HISTORY', %s, %s, %s, %s, %s, %s, %s, %s)
+        """.format(keyspace),
+        (max_uuid_from_time(time.time()), name, m.hexdigest(), ('UP' if up else 'DOWN'),
+         applied.seconds if applied else None, applied.statements if applied else None,
+         applied.coordinator if applied else None, rehearsal)
+    )
     if not up:
         # Delete
         rows = session.execute(
             """
-            SELECT time FROM shift_migrations 
-            WHERE type = 'MIGRATION' 
-                AND migration = %s 
+            SELECT time FROM {}.shift_migrations
+            WHERE type = 'MIGRATION'
+                AND migration = %s
             ALLOW FILTERING
-            """, (name,)
+            """.format(keyspace), (name,)
         )
         if not rows:
-            click.secho("Unable to select last migration from DB", fg="red")
+            secho("Unable to select last migration from DB", fg="red")
             return False
         id = rows[0].time
-        delete = session.execute("DELETE FROM shift_migrations WHERE type = 'MIGRATION' AND time = %s", (id,))
+        session.execute("DELETE FROM {}.shift_migrations WHERE type = 'MIGRATION' AND time = %s".format(keyspace), (id,))
         return
 
-    m = hashlib.md5()
-    m.update(schema)
     session.execute(
         """
-        INSERT INTO shift_migrations(type, time, migration, hash)
+        INSERT INTO {}.shift_migrations(type, time, migration, hash)
         VALUES (%s, %s, %s, %s)
-        """,
+        """.format(keyspace),
         ('MIGRATION', max_uuid_from_time(time.time()), name, m.hexdigest())
     )
-    update_snapshot(schema)
+    if snapshot:
+        update_snapshot(schema, name)
+
+
+def get_history(keyspace, page_size=100, session=None):
+    """
+    Return the rows of every migration applied or rolled back, newest first.
+    Rows are fetched page by page as they are iterated. A shift_migrations
+    table created by an older shifter has no history yet.
+    """
+    session = session or get_session()
+    columns = [c.name for c in get_table_columns(keyspace, SHIFT_TABLE, session=session)]
+    if not columns:
+        raise ShifterError('Shift hasn\'t been initialized on keyspace {}.'.format(keyspace))
+    if any(column not in columns for column, type in HISTORY_COLUMNS):
+        return []
+    statement = SimpleStatement(
+        """
+        SELECT time, migration, action, duration, statements, coordinator, rehearsal
+        FROM {}.shift_migrations WHERE type = 'HISTORY'
+        """.format(keyspace),
+        fetch_size=page_size
+    )
+    return session.execute(statement)
 
 
-def create_migration_table(keyspace):
-    session.set_keyspace(keyspace)
-    click.echo("Creating shift_migrations table... ", nl=False)
+def create_migration_table(keyspace, session=None):
+    session = session or get_session()
+    echo("Creating shift_migrations table... ", nl=False)
     try:
         session.execute(
             """
-            CREATE TABLE IF NOT EXISTS shift_migrations(
+            CREATE TABLE IF NOT EXISTS {}.shift_migrations(
                 type text,
                 time timeuuid,
                 migration text,
                 hash text,
+                action text,
+                duration double,
+                statements int,
+                coordinator text,
+                rehearsal double,
                 PRIMARY KEY (type, time)
             )
             WITH CLUSTERING ORDER BY(time DESC)
+            """.format(keyspace)
+        )
+        secho('OK', fg='green', bold=True)
+        return (True, None)
+    except Exception as e:
+        secho('ERROR', fg='red', bold=True)
+        return (False, e)
+
+
+def upgrade_migration_table(keyspace, session=None):
+    """ Add the history columns to a shift_migrations table created by an older shifter. """
+    session = session or get_session()
+    existing = [c.name for c in get_table_columns(keyspace, SHIFT_TABLE, session=session)]
+    for column, type in HISTORY_COLUMNS:
+        if column not in existing:
+            session.execute("ALTER TABLE {}.shift_migrations ADD {} {}".format(keyspace, column, type))
+
+
+def create_checkpoint_table(keyspace, session=None):
+    """ Create the table that keeps track of partially applied migrations. """
+    session = session or get_session()
+    if CHECKPOINT_TABLE in get_keyspace_tables(keyspace, session=session):
+        return (True, None)
+    echo("Creating shift_checkpoints table... ", nl=False)
+    try:
+        session.execute(
             """
+            CREATE TABLE IF NOT EXISTS {}.shift_checkpoints(
+                migration text,
+                hash text,
+                up boolean,
+                applied int,
+                time timeuuid,
+                PRIMARY KEY (migration)
+            )
+            """.format(keyspace)
         )
-        click.secho('OK', fg='green', bold=True)
+        secho('OK', fg='green', bold=True)
         return (True, None)
     except Exception as e:
-        click.secho('ERROR', fg='red', bold=True)
+        secho('ERROR', fg='red', bold=True)
         return (False, e)
 
 
-def keyspace_exists(name):
-    session.set_keyspace('system_schema')
-    ks = session.execute('SELECT keyspace_name FROM keyspaces')
+def get_checkpoint(keyspace, name, session=None):
+    """
+    Return the checkpoint of an interrupted migration as a row with the
+    hash of the file, the direction and the number of applied statements.
+    If the migration has no checkpoint, None is returned.
+    """
+    session = session or get_session()
+    if name.endswith('.cql'):
+        name = name[:-4]
+    try:
+        rows = session.execute(
+            "SELECT hash, up, applied FROM {}.shift_checkpoints WHERE migration = %s".format(keyspace),
+            (name,)
+        )
+    except Exception:
+        return None
+    if not rows:
+        return None
+    return rows[0]
+
+
+def save_checkpoint(keyspace, name, hash, up, applied, session=None):
+    session = session or get_session()
+    if name.endswith('.cql'):
+        name = name[:-4]
+    session.execute(
+        """
+        INSERT INTO {}.shift_checkpoints(migration, hash, up, applied, time)
+        VALUES (%s, %s, %s, %s, %s)
+        """.format(keyspace),
+        (name, hash, up, applied, max_uuid_from_time(time.time()))
+    )
+
+
+def clear_checkpoint(keyspace, name, session=None):
+    session = session or get_session()
+    if name.endswith('.cql'):
+        name = name[:-4]
+    session.execute("DELETE FROM {}.shift_checkpoints WHERE migration = %s".format(keyspace), (name,))
+
+
+def keyspace_exists(name, session=None):
+    session = session or get_session()
+    ks = session.execute('SELECT keyspace_name FROM system_schema.keyspaces WHERE keyspace_name = %s', [name])
     if not ks:
         return False
-    for row in ks:
-        if row.keyspace_name == name:
-            return True
-    return False
+    return True
 
 
-def auto_migrate_keyspace(source_name, target_name):
+def auto_migrate_keyspace(source_name, target_name, session=None):
     """
     Compare the 2 keyspaces and return a list of
     queries to be performed in order to sync source to target.
     """
     source = Keyspace(name=source_name, tables=[])
-    stables = get_keyspace_tables(source_name)
+    stables = get_keyspace_tables(source_name, session=session)
     for table in stables:
         source.tables.append(Table(
             name=table,
-            columns=get_table_columns(source_name, table)
+            columns=get_table_columns(source_name, table, session=session)
         ))
     target = Keyspace(name=target_name, tables=[])
-    ttables = get_keyspace_tables(target_name)
+    ttables = get_keyspace_tables(target_name, session=session)
     table = []
     for table in ttables:
         target.tables.append(Table(
             name=table,
-            columns=get_table_columns(target_name, table)
+            columns=get_table_columns(target_name, table, session=session)
         ))
     return get_keyspace_diff(source, target)
 
 
-def get_keyspace_tables(keyspace):
-    session.set_keyspace('system_schema')
-    ks = session.execute('SELECT table_name FROM tables WHERE keyspace_name = %s', [keyspace])
+def get_keyspace_tables(keyspace, session=None):
+    session = session or get_session()
+    ks = session.execute('SELECT table_name FROM system_schema.tables WHERE keyspace_name = %s', [keyspace])
     if not ks:
         return []
     tables = []
@@ -220,10 +373,11 @@ def get_keyspace_tables(keyspace):
     return tables
 
 
-def get_table_columns(keyspace, table):
+def get_table_columns(keyspace, table, session=None):
     """ Return a list of tuples (col_name, col_type). """
-    session.set_keyspace('system_schema')
-    ks = session.execute('SELECT * FROM columns WHERE keyspace_name = %s AND table_name = %s', [keyspace, table])
+    session = session or get_session()
+    ks = session.execute('SELECT * FROM system_schema.columns WHERE keyspace_name = %s AND table_name = %s',
+                         [keyspace, table])
     if not ks:
         return []
     cols = []
@@ -235,63 +389,3 @@ def get_table_columns(keyspace, table):
             order=row.clustering_order,
             position=row.position))
     return cols
-
-
-def get_columns_diff(source, target):
-    if not isinstance(source, Column) or not isinstance(target, Column):
-        raise ValueError("parameters must be Column instances")
-    if source.kind != target.kind:
-        return "kind"
-    if source.position != target.position:
-        return "position"
-    if source.type != target.type:
-        return "type"
-    return None
-
-def get_tables_diff(source, target):
-    if not isinstance(source, Table) or not isinstance(target, Table):
-        raise ValueError("parameters must be Table instances")
-    if source == target:
-        return None
-    actions = []
-    # Compare table name
-    if source.name != target.name:
-        raise ValueError("tables does not share the same name")
-    # Columns in source table
-    for col in source.columns:
-        target_col = target.get_column(col.name)
-        if not target_col:
-            actions.append(source.drop_column_cql(col))
-        else:
-            if target_col != col:
-                dif = get_columns_diff(col, target_col)
-                if dif == "type":
-                    actions.append(source.alter_column_type_cql(col.name, target_col.type))
-    # Columns in destination table
-    for col in target.columns:
-        source_col = source.get_column(col.name)
-        if not source_col:
-            actions.append(source.add_column_cql(col))
-    return actions
-
-
-def get_keyspace_diff(source, target):
-    if not isinstance(source, Keyspace) or not isinstance(target, Keyspace):
-        raise ValueError("parameters must be Table instances")
-    actions = []
-    # Source tables
-    for table in source.tables:
-        target_table = target.get_table(table.name)
-        if not target_table:
-            actions.append(table.drop_cql())
-        else:
-            a = get_tables_diff(table, target_table)
-            if a:
-                actions += a
-    # Target tables
-    for table in target.tables:
-        source_table = source.get_table(table.name)
-        if not source_table:
-            actions.append(table.dump_cql())
-    return actions
-
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Impact estimation of pending migrations.
+
+Table sizes come from system.size_estimates, which every node computes for
+its own primary token ranges only. The figures of the coordinator are
+multiplied by the number of nodes in the cluster, so they are rough numbers
+meant to tell a 10 second migration from a 10 hour one.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+from collections import namedtuple
+
+from .cql import get_sections, split_statements, get_statement_kind, get_restrictions
+from .cql import strip_comments, split_top_level
+from .db import get_session, get_keyspace_tables, get_table_columns
+from .map import Table
+from .migrate import read_migration
+
+
+# Partitions read or written per second when no throughput is configured.
+DEFAULT_THROUGHPUT = 5000
+
+TableSize = namedtuple('TableSize', ['partitions', 'bytes'])
+Estimate = namedtuple('Estimate', ['migration', 'line', 'kind', 'table', 'partitions', 'bytes',
+                                   'schema_change', 'seconds'])
+
+# Statements that change the schema of an existing table.
+SCHEMA_CHANGES = ('alter_table', 'drop_table', 'truncate', 'create_index')
+
+
+def get_table_size(keyspace, table, session=None):
+    """ Return the estimated TableSize of the table in the whole cluster. """
+    session = session or get_session()
+    rows = session.execute(
+        """
+        SELECT partitions_count, mean_partition_size FROM system.size_estimates
+        WHERE keyspace_name = %s AND table_name = %s
+        """, (keyspace, table)
+    )
+    partitions = 0
+    bytes = 0
+    for row in rows:
+        partitions += row.partitions_count
+        bytes += row.partitions_count * row.mean_partition_size
+    nodes = max(len(session.cluster.metadata.all_hosts()), 1)
+    return TableSize(partitions=partitions * nodes, bytes=bytes * nodes)
+
+
+class Catalog(object):
+    """ Tables and sizes of a keyspace, fetched once and kept as the plan goes. """
+    def __init__(self, keyspace, session=None):
+        self.keyspace = keyspace
+        self.session = session or get_session()
+        self.names = set(get_keyspace_tables(keyspace, session=self.session))
+        self.tables = {}
+        self.sizes = {}
+
+    def get_table(self, name):
+        if name not in self.names:
+            return None
+        if name not in self.tables:
+            self.tables[name] = Table(name=name, columns=get_table_columns(self.keyspace, name, session=self.session))
+        return self.tables[name]
+
+    def get_size(self, name):
+        if name not in self.names:
+            # Created by an earlier statement, so it's empty.
+            return TableSize(partitions=0, bytes=0)
+        if name not in self.sizes:
+            self.sizes[name] = get_table_size(self.keyspace, name, session=self.session)
+        return self.sizes[name]
+
+    def update(self, kind, name):
+        """ Forget the tables dropped by the plan, they will be empty if created again. """
+        if kind == 'drop_table':
+            self.names.discard(name)
+            self.sizes.pop(name, None)
+            self.tables.pop(name, None)
+
+
+def get_touched_partitions(code, table, size):
+    """ Return how many partitions of the table the data statement touches. """
+    restrictions = get_restrictions(code)
+    if restrictions is None or table is None:
+        return size.partitions if restrictions is None else 1
+    keys = table.primary_keys()
+    if not keys or any(k not in restrictions for k in keys):
+        return size.partitions
+    partitions = 1
+    for k in keys:
+        partitions *= restrictions[k]
+    return partitions
+
+
+def estimate_statement(migration, statement, catalog, throughput):
+    code = strip_comments(statement.text).strip()
+    kind, name = get_statement_kind(code)
+    size = catalog.get_size(name) if name else TableSize(partitions=0, bytes=0)
+    table = catalog.get_table(name) if name else None
+    partitions = 0
+    bytes = 0
+    if kind in ('create_index', 'drop_table', 'truncate'):
+        # The whole table is read (index build) or thrown away.
+        partitions, bytes = size.partitions, size.bytes
+    elif kind in ('insert', 'update', 'delete', 'select'):
+        # An INSERT writes a single row, it has no WHERE clause to look at.
+        partitions = 1 if kind == 'insert' else get_touched_partitions(code, table, size)
+        if size.partitions:
+            bytes = size.bytes * min(partitions, size.partitions) // size.partitions
+    elif kind == 'batch':
+        partitions = len(split_top_level(code, ';')) - 1
+    seconds = 0
+    if kind not in ('drop_table', 'truncate'):
+        seconds = partitions / float(throughput)
+    catalog.update(kind, name)
+    return Estimate(migration=migration, line=statement.line, kind=kind, table=name,
+                    partitions=partitions, bytes=bytes,
+                    schema_change=(kind in SCHEMA_CHANGES and size.partitions > 0), seconds=seconds)
+
+
+def estimate_migrations(pending, up, keyspace, throughput=DEFAULT_THROUGHPUT, start=0, session=None):
+    """
+    Return the list of Estimates of every statement of the pending migrations,
+    skipping the first start statements of the first one (already applied).
+    """
+    catalog = Catalog(keyspace, session=session)
+    estimates = []
+    for i, f in enumerate(pending):
+        content = read_migration(f)
+        if content is None:
+            continue
+        for section, text, line in get_sections(content):
+            if section != ('UP' if up else 'DOWN'):
+                continue
+            for j, statement in enumerate(split_statements(text, line, section)):
+                if i == 0 and j < start:
+                    continue
+                estimates.append(estimate_statement(f, statement, catalog, throughput))
+    return estimates
+
+
+def format_bytes(bytes):
+    for unit in ('B', 'KB', 'MB', 'GB', 'TB'):
+        if bytes < 1024 or unit == 'TB':
+            return '{:.1f} {}'.format(bytes, unit) if unit != 'B' else '{} B'.format(int(bytes))
+        bytes /= 1024.0
+
+
+def format_seconds(seconds):
+    seconds = int(round(seconds))
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if hours:
+        return '{}h {}m'.format(hours, minutes)
+    if minutes:
+        return '{}m {}s'.format(minutes, seconds)
+    return '{}s'.format(seconds)
+
+
+def format_estimate(estimate):
+    line = 'line {}: {} {}'.format(estimate.line, (estimate.kind or 'other').upper().replace('_', ' '),
+                                   estimate.table or '')
+    line = '{:<40} ~{} partitions, {}, ~{}'.format(line, estimate.partitions, format_bytes(estimate.bytes),
+                                                    format_seconds(estimate.seconds))
+    if estimate.schema_change:
+        line += ' (schema change under load)'
+    return line
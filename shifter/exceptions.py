@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+
+class ShifterError(Exception):
+    """ Base class of every error raised by shifter. """
+
+
+class SettingsError(ShifterError):
+    """ The settings module is missing or incomplete. """
+
+
+class ConnectError(ShifterError):
+    """ Unable to connect to Cassandra. """
+
+
+class MigrationError(ShifterError):
+    """ A migration could not be planned or applied. """
+    def __init__(self, message, migration=None, cause=None):
+        super(MigrationError, self).__init__(message)
+        self.migration = migration
+        self.cause = cause
+
+
+class LintError(MigrationError):
+    """ The migrations have performance hazards flagged as errors. """
+    def __init__(self, message, findings=None):
+        super(LintError, self).__init__(message)
+        self.findings = findings or []
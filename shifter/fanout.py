@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Apply the migrations to several clusters at once.
+
+Clusters are given as waves of settings modules. The clusters of a wave are
+migrated concurrently, each one with its own cluster and session, and a wave
+only starts if every cluster of the previous one was migrated successfully.
+Only the first cluster of the first wave updates the local schema snapshots,
+so they don't depend on which cluster finishes last.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from . import api
+from .config import load_config
+from .output import echo
+
+MIGRATED = 'migrated'
+UP_TO_DATE = 'up to date'
+DELEGATED = 'delegated'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+Target = namedtuple('Target', ['settings', 'config'])
+Outcome = namedtuple('Outcome', ['wave', 'settings', 'keyspace', 'state', 'result', 'error', 'seconds'])
+
+
+def load_waves(waves):
+    """ Return the waves of settings module names as waves of Targets. """
+    return [[Target(settings=s, config=load_config(s)) for s in wave] for wave in waves]
+
+
+def migrate_target(wave, target, head, snapshot, options):
+    """ Migrate one cluster and return its Outcome. Errors are returned, not raised. """
+    started = time.time()
+    result = None
+    error = None
+    try:
+        result = api.migrate(target.config, head, verbose=False, snapshot=snapshot, **options)
+    except Exception as e:
+        error = e
+    if error is not None:
+        state = FAILED
+    elif result.delegated:
+        state = DELEGATED
+    else:
+        state = MIGRATED if result.applied else UP_TO_DATE
+    return Outcome(wave=wave, settings=target.settings, keyspace=target.config['keyspace'], state=state,
+                   result=result, error=error, seconds=time.time() - started)
+
+
+def fan_out(waves, head=None, max_workers=None, **options):
+    """
+    Migrate the Targets of every wave concurrently, wave after wave, and
+    return the Outcome of each one. Once a wave fails, the targets of the
+    following ones are SKIPPED. Options are passed to api.migrate.
+    """
+    outcomes = []
+    failed = False
+    for i, wave in enumerate(waves, 1):
+        if failed:
+            outcomes += [Outcome(wave=i, settings=t.settings, keyspace=t.config['keyspace'], state=SKIPPED,
+                                 result=None, error=None, seconds=0) for t in wave]
+            continue
+        echo('Wave {}: migrating {}...'.format(i, ', '.join(t.settings for t in wave)))
+        with ThreadPoolExecutor(max_workers=(max_workers or len(wave))) as executor:
+            futures = [executor.submit(migrate_target, i, t, head, t is waves[0][0], options) for t in wave]
+            done = [f.result() for f in futures]
+        outcomes += done
+        failed = any(o.state == FAILED for o in done)
+    return outcomes
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+import os
+import time
+import uuid
+import random
+import socket
+import threading
+
+from .db import get_session, get_keyspace_tables
+from .output import echo, secho
+
+
+LEASE_TABLE = 'shift_lease'
+LEASE_NAME = 'migrate'
+
+
+def create_lease_table(keyspace, session=None):
+    """ Create the table that holds the migration lease if it does not exist yet. """
+    session = session or get_session()
+    if LEASE_TABLE in get_keyspace_tables(keyspace, session=session):
+        return
+    session.execute(
+        """
+        CREATE TABLE IF NOT EXISTS {}.shift_lease(
+            name text,
+            owner text,
+            renewed timestamp,
+            PRIMARY KEY (name)
+        )
+        """.format(keyspace)
+    )
+
+
+class Lease(object):
+    """
+    A lease on the keyspace migrations taken with a lightweight transaction.
+
+    The lease row expires after ttl seconds unless it is renewed, so a
+    process that dies while holding it only blocks the others for a while.
+    """
+    def __init__(self, keyspace, ttl=30, name=LEASE_NAME, session=None):
+        self.session = session or get_session()
+        self.keyspace = keyspace
+        self.ttl = int(ttl)
+        self.name = name
+        self.owner = '{}:{}:{}'.format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+        self.lost = False
+        # Last time the lease was known to be ours.
+        self.renewed = None
+        self._stop = None
+        self._thread = None
+
+    def holder(self):
+        """ Return the current owner of the lease or None if it is free. """
+        rows = self.session.execute(
+            "SELECT owner FROM {}.shift_lease WHERE name = %s".format(self.keyspace),
+            (self.name,)
+        )
+        if not rows:
+            return None
+        return rows[0].owner
+
+    def acquire(self):
+        rows = self.session.execute(
+            """
+            INSERT INTO {}.shift_lease(name, owner, renewed)
+            VALUES (%s, %s, toTimestamp(now()))
+            IF NOT EXISTS USING TTL {}
+            """.format(self.keyspace, self.ttl),
+            (self.name, self.owner)
+        )
+        if rows[0][0]:
+            self.renewed = time.time()
+        return bool(rows[0][0])
+
+    def renew(self):
+        rows = self.session.execute(
+            """
+            UPDATE {}.shift_lease USING TTL {}
+            SET owner = %s, renewed = toTimestamp(now())
+            WHERE name = %s
+            IF owner = %s
+            """.format(self.keyspace, self.ttl),
+            (self.owner, self.name, self.owner)
+        )
+        return bool(rows[0][0])
+
+    def release(self):
+        self.stop_heartbeat()
+        try:
+            self.session.execute(
+                "DELETE FROM {}.shift_lease WHERE name = %s IF owner = %s".format(self.keyspace),
+                (self.name, self.owner)
+            )
+        except Exception:
+            # The lease will expire on its own.
+            pass
+
+    def start_heartbeat(self):
+        """ Keep renewing the lease in the background until it is released. """
+        self.renewed = self.renewed or time.time()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._heartbeat)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop_heartbeat(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.ttl / 3.0):
+            try:
+                renewed = self.renew()
+            except Exception:
+                # Keep trying while the lease has not expired.
+                if time.time() - self.renewed < self.ttl:
+                    continue
+                renewed = False
+            if renewed:
+                self.renewed = time.time()
+            else:
+                self.lost = True
+                secho('Migration lease lost!', fg='red', bold=True)
+                return
+
+
+def wait_for_lease(lease, is_done, max_delay=10):
+    """
+    Take the lease, waiting for the current holder if needed.
+    Return True once the lease is ours or False as soon as is_done()
+    tells that the holder has already done the work for us.
+    While waiting, only the lease row is read, the lightweight transaction
+    is attempted again only when the lease looks free.
+    """
+    if lease.acquire():
+        return True
+    echo('Another process holds the migration lease ({}), waiting... '.format(lease.holder()))
+    delay = 0.5
+    while True:
+        time.sleep(delay * random.uniform(0.5, 1.5))
+        delay = min(delay * 2, max_delay)
+        if is_done():
+            return False
+        if lease.holder() is None and lease.acquire():
+            return True
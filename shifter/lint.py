@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+Performance linter for migration files.
+
+Every rule can be silenced for one statement with a comment inside it (or
+right before it), or for the whole file:
+
+    /* shifter: disable=allow-filtering */
+    /* shifter: disable-file=secondary-index,unbounded-scan */
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+import re
+from collections import namedtuple
+
+from .cql import get_sections, split_statements, get_statement_kind, strip_comments
+from .cql import parse_table, parse_schema, split_top_level, unquote, get_restrictions
+from .migrate import read_migration
+from .db import get_snapshot
+
+
+ERROR = 'error'
+WARNING = 'warning'
+
+Finding = namedtuple('Finding', ['file', 'line', 'rule', 'severity', 'message'])
+
+# Rule name -> default severity.
+RULES = {
+    'allow-filtering': ERROR,
+    'high-cardinality-index': ERROR,
+    'secondary-index': WARNING,
+    'unbounded-scan': WARNING,
+    'drop-recreate': ERROR,
+    'large-batch': ERROR,
+}
+
+# Logged batches with more statements than this put too much pressure on the coordinator.
+LARGE_BATCH = 20
+HIGH_CARDINALITY_TYPES = ('uuid', 'timeuuid', 'timestamp', 'blob', 'bigint', 'varint', 'decimal', 'double')
+
+DISABLE_RE = re.compile(r'/\*\s*shifter:\s*disable=([\w,\s-]+?)\s*\*/')
+DISABLE_FILE_RE = re.compile(r'/\*\s*shifter:\s*disable-file=([\w,\s-]+?)\s*\*/')
+INDEX_COLUMN_RE = re.compile(r'\bON\s+[\w."]+\s*\((.*)\)', re.I | re.S)
+
+
+def get_disabled(regex, text):
+    rules = set()
+    for m in regex.finditer(text):
+        rules.update(r.strip() for r in m.group(1).split(',') if r.strip())
+    return rules
+
+
+def lint_statement(statement, schema, dropped):
+    """ Yield (rule, message) for every hazard found in the statement. """
+    code = strip_comments(statement.text).strip()
+    kind, name = get_statement_kind(code)
+    table = schema.get_table(name) if name else None
+
+    if re.search(r'\bALLOW\s+FILTERING\b', code, re.I):
+        yield ('allow-filtering', 'ALLOW FILTERING scans every partition of the table.')
+
+    if kind == 'create_index':
+        m = INDEX_COLUMN_RE.search(code)
+        column = None
+        if m and table is not None:
+            target = m.group(1).strip()
+            target = re.sub(r'^(?:keys|values|entries|full)\s*\((.*)\)$', r'\1', target, flags=re.I)
+            column = table.get_column(unquote(target.strip()))
+        base = column.type.split('<')[0] if column is not None else None
+        if base in HIGH_CARDINALITY_TYPES:
+            yield ('high-cardinality-index',
+                   'Secondary index on {}.{} ({}), a high cardinality column.'.format(name, column.name, column.type))
+        else:
+            yield ('secondary-index', 'Secondary index on {}: every read on it asks all the nodes.'.format(name))
+
+    if kind in ('select', 'update', 'delete'):
+        restricted = get_restrictions(code)
+        if restricted is None:
+            yield ('unbounded-scan', '{} without WHERE touches every partition of {}.'.format(kind.upper(), name))
+        elif table is not None and re.search(r'\bTOKEN\s*\(', code, re.I) is None:
+            missing = [c for c in table.primary_keys() if c not in restricted]
+            if missing:
+                yield ('unbounded-scan', '{} does not restrict the partition key ({}) of {}.'.format(
+                    kind.upper(), ', '.join(missing), name))
+
+    if kind == 'drop_table':
+        dropped.add(name)
+    elif kind == 'create_table' and name in dropped:
+        yield ('drop-recreate', 'Table {} is dropped and created again, the data is lost and the '
+                                'tombstones and schema changes hit every node.'.format(name))
+
+    if kind == 'batch' and not re.match(r'^BEGIN\s+(UNLOGGED|COUNTER)\b', code, re.I):
+        count = len(split_top_level(re.sub(r'^BEGIN\s+BATCH|APPLY\s+BATCH$', '', code, flags=re.I), ';'))
+        if count > LARGE_BATCH:
+            yield ('large-batch', 'Logged batch with {} statements (more than {}).'.format(count, LARGE_BATCH))
+
+
+def lint_content(content, file='', schema=None, sections=('UP', 'DOWN')):
+    """ Return the list of Findings of the given sections of the migration content. """
+    schema = schema if schema is not None else parse_schema('')
+    file_disabled = get_disabled(DISABLE_FILE_RE, content)
+    findings = []
+    for section, text, line in get_sections(content):
+        if section not in sections:
+            continue
+        dropped = set()
+        for statement in split_statements(text, line, section):
+            disabled = file_disabled | get_disabled(DISABLE_RE, statement.text)
+            for rule, message in lint_statement(statement, schema, dropped):
+                if rule in disabled or 'all' in disabled:
+                    continue
+                findings.append(Finding(file=file, line=statement.line, rule=rule,
+                                        severity=RULES[rule], message=message))
+            if section == 'UP':
+                update_schema(schema, statement)
+    return findings
+
+
+def update_schema(schema, statement):
+    """ Keep the known schema up to date with the tables created or dropped by the statement. """
+    kind, name = get_statement_kind(statement.text)
+    if kind == 'drop_table' and schema.get_table(name):
+        schema.tables.remove(schema.get_table(name))
+    elif kind == 'create_table' and not schema.get_table(name):
+        schema.tables.append(parse_table(statement.text))
+
+
+def lint_migrations(files, schema=None, sections=('UP', 'DOWN')):
+    """
+    Lint the given sections of the migration files in order against the
+    schema (the last snapshot if not given). Unreadable files are reported
+    as errors.
+    """
+    if schema is None:
+        schema = parse_schema(get_snapshot() or '')
+    findings = []
+    for f in files:
+        content = read_migration(f)
+        if content is None:
+            findings.append(Finding(file=f, line=0, rule='unreadable', severity=ERROR,
+                                    message='Unable to open file {}.'.format(f)))
+            continue
+        findings += lint_content(content, f, schema, sections)
+    return findings
+
+
+def format_finding(finding):
+    return 'migrations/{}:{}: {} [{}] {}'.format(finding.file, finding.line, finding.severity,
+                                                 finding.rule, finding.message)
@@ -111,4 +111,63 @@ class Keyspace(object):
         for t in self.tables:
             if t.name == name:
                 return t
-        return None
\ No newline at end of file
+        return None
+
+
+def get_columns_diff(source, target):
+    if not isinstance(source, Column) or not isinstance(target, Column):
+        raise ValueError("parameters must be Column instances")
+    if source.kind != target.kind:
+        return "kind"
+    if source.position != target.position:
+        return "position"
+    if source.type != target.type:
+        return "type"
+    return None
+
+def get_tables_diff(source, target):
+    if not isinstance(source, Table) or not isinstance(target, Table):
+        raise ValueError("parameters must be Table instances")
+    if source == target:
+        return None
+    actions = []
+    # Compare table name
+    if source.name != target.name:
+        raise ValueError("tables does not share the same name")
+    # Columns in source table
+    for col in source.columns:
+        target_col = target.get_column(col.name)
+        if not target_col:
+            actions.append(source.drop_column_cql(col))
+        else:
+            if target_col != col:
+                dif = get_columns_diff(col, target_col)
+                if dif == "type":
+                    actions.append(source.alter_column_type_cql(col.name, target_col.type))
+    # Columns in destination table
+    for col in target.columns:
+        source_col = source.get_column(col.name)
+        if not source_col:
+            actions.append(source.add_column_cql(col))
+    return actions
+
+
+def get_keyspace_diff(source, target):
+    if not isinstance(source, Keyspace) or not isinstance(target, Keyspace):
+        raise ValueError("parameters must be Table instances")
+    actions = []
+    # Source tables
+    for table in source.tables:
+        target_table = target.get_table(table.name)
+        if not target_table:
+            actions.append(table.drop_cql())
+        else:
+            a = get_tables_diff(table, target_table)
+            if a:
+                actions += a
+    # Target tables
+    for table in target.tables:
+        source_table = source.get_table(table.name)
+        if not source_table:
+            actions.append(table.dump_cql())
+    return actions
@@ -1,26 +1,33 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, division, print_function, unicode_literals
 import os
-import sys
-import click
 import time
+import hashlib
 import warnings
+from collections import namedtuple
+import six
 
 from .db import get_current_schema, get_session
-from .db import update_snapshot
+from .db import update_snapshot, save_checkpoint
+from .cql import get_sections, split_statements
+from .output import echo, secho
+from .exceptions import ShifterError, MigrationError
 
 warnings.filterwarnings("ignore")
 
+Applied = namedtuple('Applied', ['statements', 'seconds', 'coordinator', 'durations'])
 
-def get_last_migration(config):
+
+def get_last_migration(config, session=None):
     """
     Get the last migration stored on cassandra.
     If there is no first migration, it will return 0
     If there is no table shift_migrations, it will return None
     """
-    get_session().set_keyspace(config['keyspace'])
+    session = session or get_session()
     try:
-        migrations = get_session().execute("SELECT migration FROM shift_migrations LIMIT 1")
+        migrations = session.execute(
+            "SELECT migration FROM {}.shift_migrations WHERE type = 'MIGRATION' LIMIT 1".format(config['keyspace']))
         if not migrations:
             return 0
         last_migration = migrations[0].migration
@@ -39,8 +46,7 @@ def get_migrations_on_file():
             if f[-3:] == 'cql':
                 files.append(f)
     except Exception:
-        click.secho('Unable to open the migrations directory!', fg='red')
-        sys.exit()
+        raise ShifterError('Unable to open the migrations directory!')
     files.sort()
     return files
 
@@ -72,8 +78,7 @@ def get_pending_migrations(last_migration, migrations, head=None):
     Pending migrations will be returned IN ORDER in which they must be executed.
     """
     if last_migration and '{}.cql'.format(last_migration) not in migrations:
-        click.secho('Unable to migrate because migrations DB is ahead of migrations on file.', fg='red')
-        sys.exit()
+        raise MigrationError('Unable to migrate because migrations DB is ahead of migrations on file.')
     if not last_migration:
         last_migration = 0
     else:
@@ -85,13 +90,12 @@ def get_pending_migrations(last_migration, migrations, head=None):
     # largest migration on file.
     target = files_head if head is None else int(head)
     if target > files_head:
-        click.secho('The target migration provided does not exist in the migrations dir.', fg='red')
-        sys.exit()
+        raise MigrationError('The target migration provided does not exist in the migrations dir.')
     # Are we migrating up or down?
     up = True if pointer <= target else False
 
     if not up:
-        migrations.sort(reverse=True)
+        migrations = sorted(migrations, reverse=True)
 
     pending = []
     for m in migrations:
@@ -114,7 +118,47 @@ def get_pending_migrations(last_migration, migrations, head=None):
     return (pending, up)
 
 
-def apply_migration(file, up, keyspace):
+def read_migration(file):
+    """ Return the raw content of the given migration file or None if it can't be read. """
+    try:
+        file = open('migrations/{}'.format(file), 'r')
+        content = file.read()
+        file.close()
+    except Exception:
+        return None
+    return content
+
+
+def get_migration_hash(content):
+    """ Return the hash that identifies the given migration content. """
+    if isinstance(content, six.text_type):
+        content = content.encode('utf-8')
+    m = hashlib.md5()
+    m.update(content)
+    return m.hexdigest()
+
+
+def get_statements_hash(statements):
+    """ Return the hash that identifies the given statements, as checkpointed. """
+    return get_migration_hash('\n;\n'.join(statements))
+
+
+def get_migration_statements(content, up):
+    """
+    Return the list of statements of the UP or DOWN section of the
+    given migration content, in the order in which they must be executed.
+    They are split the same way the linter and the estimator do, so a
+    BEGIN BATCH ... APPLY BATCH block is a single statement.
+    If the content has no --DOWN-- section, None is returned.
+    """
+    sections = get_sections(content)
+    if len(sections) < 2 or not sections[1][1]:
+        return None
+    section, text, line = sections[0 if up else 1]
+    return [s.text for s in split_statements(text, line, section)]
+
+
+def apply_migration(file, up, keyspace, start=0, checkpoint=None, session=None, content=None):
     """
     Apply the migration given the raw file name.
     If up is True, then it will execute the up statement, else it will execute the down statement.
@@ -125,41 +169,56 @@ def apply_migration(file, up, keyspace):
     --DOWN--
     /* Your CQL statements here. They MUST revert what the UP statements do */
 
+    Statements before the start index are skipped, which allows to resume an
+    interrupted migration. If checkpoint is the name of a keyspace, the progress
+    is recorded in its shift_checkpoints table after every statement. The caller
+    must clear it once the migration is recorded as the new head. If content is given, it's applied
+    instead of the current content of the file.
+
+    Returns (False, error) on failure or (True, Applied) with the number of
+    statements executed, the time it took, the hosts that coordinated them and
+    the list of (statement, seconds) of every statement.
     """
+    session = session or get_session()
     fname = file
-    click.echo("Applying migration {} {} ".format(file, ('UP' if up else 'DOWN')), nl=False)
-    try:
-        file = open('migrations/{}'.format(file), 'r')
-        content = file.read()
-        file.close()
-    except Exception:
-        click.secho('ERROR', fg='red', bold=True)
+    echo("Applying migration {} {} ".format(file, ('UP' if up else 'DOWN')), nl=False)
+    content = read_migration(file) if content is None else content
+    if content is None:
+        secho('ERROR', fg='red', bold=True)
         return (False, 'Unable to open file {}.'.format(file))
-    content = content.replace('--UP--', '', 1)
-    parts = content.split('--DOWN--')
-    if len(parts) > 1:
-        qryup, qrydown = parts
-    else:
-        qryup = parts[0]
-        qrydown = None
 
-    if not qrydown:
-        click.secho('ERROR', fg='red', bold=True)
+    statements = get_migration_statements(content, up)
+    if statements is None:
+        secho('ERROR', fg='red', bold=True)
         return (False, 'File {} does not include a --DOWN-- statement.'.format(fname))
+    if start > 0:
+        echo("(resuming at statement {} of {}) ".format(start + 1, len(statements)), nl=False)
 
     if keyspace is not None:
-        get_session().set_keyspace(keyspace)
-    qry = qryup if up else qrydown
+        session.set_keyspace(keyspace)
+    coordinators = []
+    durations = []
+    started = time.time()
     try:
-        for q in qry.replace('\n', '').split(';'):
-            q = q.strip()
-            if q != '':
-                get_session().execute(q.strip())
+        for i, q in enumerate(statements):
+            if i < start:
+                continue
+            executed = time.time()
+            rows = session.execute(q)
+            durations.append((q, time.time() - executed))
+            host = getattr(rows.response_future, 'coordinator_host', None)
+            if host and str(host) not in coordinators:
+                coordinators.append(str(host))
+            if checkpoint is not None:
+                # Only the statements applied so far must stay as they are to resume.
+                save_checkpoint(checkpoint, fname, get_statements_hash(statements[:i + 1]), up, i + 1,
+                                session=session)
     except Exception as e:
-        click.secho('ERROR', fg='red', bold=True)
+        secho('ERROR', fg='red', bold=True)
         return (False, e)
-    click.secho('OK', fg='green', bold=True)
-    return (True, None)
+    secho('OK', fg='green', bold=True)
+    return (True, Applied(statements=len(statements) - start, seconds=time.time() - started,
+                          coordinator=','.join(coordinators), durations=durations))
 
 
 def create_migration_file(name, up, down=None, title='', description='',
@@ -206,13 +265,13 @@ def create_init_migration(config):
     This function will also write the current keyspace schema (the one
     defined in the current settings) as the content of the file.
     """
-    click.echo("Creating migration genesis... ", nl=False)
+    echo("Creating migration genesis... ", nl=False)
     if os.path.isfile('migrations/00000.cql'):
-        click.secho('ERROR (already exists)', fg='red', bold=True)
+        secho('ERROR (already exists)', fg='red', bold=True)
         return False
     current = get_current_schema(config)
     down = 'DROP KEYSPACE {};'.format(config.get('keyspace'))
     new_file = create_migration_file(name='', title='MIGRATION GENESIS', up=current, down=down, genesis=True)
-    click.secho('OK', fg='green', bold=True)
-    update_snapshot(current)
+    secho('OK', fg='green', bold=True)
+    update_snapshot(current, new_file)
     return new_file
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+import threading
+from contextlib import contextmanager
+
+import click
+
+_state = threading.local()
+
+
+def is_quiet():
+    return getattr(_state, 'quiet', False)
+
+
+@contextmanager
+def quiet(enabled=True):
+    """ Silence the progress output of the current thread. """
+    previous = is_quiet()
+    _state.quiet = enabled
+    try:
+        yield
+    finally:
+        _state.quiet = previous
+
+
+def echo(message=None, **kwargs):
+    if not is_quiet():
+        click.echo(message, **kwargs)
+
+
+def secho(message=None, **kwargs):
+    if not is_quiet():
+        click.secho(message, **kwargs)
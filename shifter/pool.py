@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+A pool of rehearsal keyspaces shared by every shifter run against a cluster.
+
+Pooled keyspaces are registered in shifter_pool.keyspaces together with the
+fingerprint of the schema they hold. A run leases a free keyspace with the
+fingerprint of the schema it needs (taken with a lightweight transaction),
+rehearses the pending migrations on it and rolls them back with their DOWN
+sections before returning it. Keyspaces that can't be rolled back exactly to
+the schema they were leased with, or where rows were written, are dropped,
+and the ones unused for longer than the TTL are evicted.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+import os
+import uuid
+import socket
+import hashlib
+import datetime
+
+import six
+
+from .db import get_session, keyspace_exists, create_demo_keyspace, delete_demo_keyspace
+from .cql import get_sections, split_statements, get_statement_kind
+from .migrate import read_migration
+from .output import echo
+
+
+POOL_KEYSPACE = 'shifter_pool'
+POOL_PREFIX = 'cm_pool_'
+# Statements that leave rows behind, DOWN sections don't restore data.
+DATA_KINDS = ('insert', 'update', 'delete', 'batch')
+
+
+def get_schema_fingerprint(schema, schema_name):
+    """ Return the fingerprint of a schema dump, regardless of the keyspace name. """
+    schema = schema.replace("CREATE KEYSPACE {}".format(schema_name), "CREATE KEYSPACE _", 1)
+    schema = schema.replace("{}.".format(schema_name), "_.")
+    m = hashlib.md5()
+    m.update(schema.encode('utf-8') if isinstance(schema, six.text_type) else schema)
+    return m.hexdigest()
+
+
+def writes_data(files):
+    """ Return True if any section of the migration files writes rows. """
+    for f in files:
+        for section, text, line in get_sections(read_migration(f) or ''):
+            for statement in split_statements(text, line, section):
+                if get_statement_kind(statement.text)[0] in DATA_KINDS:
+                    return True
+    return False
+
+
+def create_pool_keyspace(session=None):
+    session = session or get_session()
+    if keyspace_exists(POOL_KEYSPACE, session=session):
+        return
+    session.execute(
+        """
+        CREATE KEYSPACE IF NOT EXISTS {}
+        WITH replication = {{'class': 'SimpleStrategy', 'replication_factor': '1'}}
+        """.format(POOL_KEYSPACE)
+    )
+    session.execute(
+        """
+        CREATE TABLE IF NOT EXISTS {}.keyspaces(
+            name text,
+            fingerprint text,
+            state text,
+            owner text,
+            leased timestamp,
+            used timestamp,
+            PRIMARY KEY (name)
+        )
+        """.format(POOL_KEYSPACE)
+    )
+
+
+class Pool(object):
+    """
+    Rehearsal keyspaces pool. size is the maximum number of pooled keyspaces
+    (approximate, concurrent runs may go slightly over it) and ttl the seconds
+    after which an unused or abandoned keyspace is evicted.
+    """
+    def __init__(self, size=8, ttl=3600, session=None):
+        self.size = size
+        self.ttl = ttl
+        self.session = session or get_session()
+        self.owner = '{}:{}:{}'.format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+        # Schema of every leased keyspace when it was leased.
+        self.baselines = {}
+        create_pool_keyspace(session=self.session)
+
+    def entries(self):
+        return list(self.session.execute(
+            "SELECT name, fingerprint, state, owner, leased, used FROM {}.keyspaces".format(POOL_KEYSPACE)))
+
+    def _take(self, entry, fingerprint=None):
+        """
+        Lease the entry if it's still free and, if a fingerprint is given,
+        still holds that schema (another run may have rebuilt it meanwhile).
+        """
+        condition = "state = 'free'"
+        params = (self.owner, entry.name)
+        if fingerprint is not None:
+            condition += " AND fingerprint = %s"
+            params += (fingerprint,)
+        rows = self.session.execute(
+            """
+            UPDATE {}.keyspaces SET state = 'leased', owner = %s, leased = toTimestamp(now())
+            WHERE name = %s IF {}
+            """.format(POOL_KEYSPACE, condition),
+            params
+        )
+        return bool(rows[0][0])
+
+    def lease(self, schema, schema_name):
+        """
+        Return the name of a pooled keyspace holding the given schema, built
+        or rebuilt if needed, or None if the pool is exhausted.
+        """
+        fingerprint = get_schema_fingerprint(schema, schema_name)
+        entries = self.evict()
+        for entry in entries:
+            if entry.state == 'free' and entry.fingerprint == fingerprint and self._take(entry, fingerprint):
+                echo("Reusing pooled keyspace {}.".format(entry.name))
+                self.baselines[entry.name] = self.get_schema(entry.name)
+                return entry.name
+
+        if len(entries) < self.size:
+            name = POOL_PREFIX + uuid.uuid4().hex[:12]
+            self.session.execute(
+                """
+                INSERT INTO {}.keyspaces(name, state, owner, leased)
+                VALUES (%s, 'leased', %s, toTimestamp(now())) IF NOT EXISTS
+                """.format(POOL_KEYSPACE),
+                (name, self.owner)
+            )
+        else:
+            # Reuse the least recently used free keyspace for the new schema.
+            free = [e for e in entries if e.state == 'free']
+            free.sort(key=lambda e: e.used or datetime.datetime.min)
+            name = None
+            for entry in free:
+                if self._take(entry):
+                    name = entry.name
+                    break
+            if name is None:
+                return None
+        try:
+            create_demo_keyspace(schema, schema_name, name, session=self.session)
+        except Exception:
+            self.discard(name)
+            raise
+        self.session.execute(
+            "UPDATE {}.keyspaces SET fingerprint = %s WHERE name = %s".format(POOL_KEYSPACE),
+            (fingerprint, name)
+        )
+        self.baselines[name] = self.get_schema(name)
+        return name
+
+    def get_schema(self, name):
+        """
+        Return the schema of the pooled keyspace as known by the driver, regardless
+        of its name. The driver refreshes it after every schema change it executes.
+        """
+        keyspace = self.session.cluster.metadata.keyspaces.get(name)
+        if keyspace is None:
+            return None
+        return keyspace.export_as_string().replace(name, '_')
+
+    def is_pristine(self, name):
+        """
+        Return True if the keyspace has the schema it was leased with and no
+        record of dropped columns, which would make adding them again fail.
+        """
+        if self.baselines.get(name) is None or self.get_schema(name) != self.baselines[name]:
+            return False
+        dropped = self.session.execute(
+            "SELECT column_name FROM system_schema.dropped_columns WHERE keyspace_name = %s", (name,))
+        return not dropped
+
+    def release(self, name):
+        """ Give the keyspace back to the pool. It must hold the schema it was leased with. """
+        self.baselines.pop(name, None)
+        self.session.execute(
+            """
+            UPDATE {}.keyspaces SET state = 'free', owner = null, used = toTimestamp(now())
+            WHERE name = %s IF owner = %s
+            """.format(POOL_KEYSPACE),
+            (name, self.owner)
+        )
+
+    def discard(self, name):
+        """ Drop the keyspace and remove it from the pool. """
+        self.baselines.pop(name, None)
+        delete_demo_keyspace(name, session=self.session)
+        self.session.execute("DELETE FROM {}.keyspaces WHERE name = %s".format(POOL_KEYSPACE), (name,))
+
+    def evict(self, everything=False):
+        """
+        Drop the keyspaces unused for longer than the TTL (or leased for
+        longer than that, their owner is gone) and return the remaining entries.
+        """
+        now = datetime.datetime.utcnow()
+        expiry = datetime.timedelta(seconds=self.ttl)
+        remaining = []
+        for entry in self.entries():
+            if entry.state == 'free':
+                stale = everything or (entry.used is not None and now - entry.used > expiry)
+                condition, value = 'state', 'free'
+            else:
+                stale = everything or entry.leased is None or now - entry.leased > expiry
+                condition, value = 'owner', entry.owner
+            if not stale:
+                remaining.append(entry)
+                continue
+            rows = self.session.execute(
+                "DELETE FROM {}.keyspaces WHERE name = %s IF {} = %s".format(POOL_KEYSPACE, condition),
+                (entry.name, value)
+            )
+            if rows[0][0]:
+                echo("Evicting pooled keyspace {}.".format(entry.name))
+                delete_demo_keyspace(entry.name, session=self.session)
+        return remaining
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Copy a sample of the partitions of a keyspace into the demo keyspace so the
+rehearsal runs on real data.
+
+Partitions are sampled by token range: a few random tokens of the Murmur3
+ring are picked, the partitions that follow each of them are listed with
+SELECT DISTINCT and their rows are copied with SELECT JSON / INSERT JSON.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+import random
+from collections import namedtuple
+
+from cassandra.concurrent import execute_concurrent_with_args
+
+from .cql import get_sections, split_statements, get_statement_kind, get_restrictions, strip_comments
+from .db import get_session, get_keyspace_tables, get_table_columns
+from .estimate import get_table_size
+from .map import Table
+from .migrate import read_migration
+from .output import echo, secho
+
+
+MIN_TOKEN = -2 ** 63
+MAX_TOKEN = 2 ** 63 - 1
+# Number of token ranges the sample of every table is spread over.
+SAMPLE_RANGES = 16
+
+Sample = namedtuple('Sample', ['table', 'keys', 'partitions', 'rows', 'fraction'])
+Timing = namedtuple('Timing', ['migration', 'seconds', 'fraction', 'projected'])
+
+
+def get_touched_tables(pending, up):
+    """ Return the names of the tables the statements of the pending migrations work on. """
+    tables = []
+    for f in pending:
+        content = read_migration(f) or ''
+        for section, text, line in get_sections(content):
+            if section != ('UP' if up else 'DOWN'):
+                continue
+            for statement in split_statements(text, line, section):
+                kind, name = get_statement_kind(statement.text)
+                if name and name not in tables:
+                    tables.append(name)
+    return tables
+
+
+def get_sample_tokens(count):
+    """ Return count random tokens spread evenly over the ring. """
+    step = (MAX_TOKEN - MIN_TOKEN) // count
+    return [MIN_TOKEN + i * step + random.randint(0, step - 1) for i in range(count)]
+
+
+def copy_sample(keyspace, target, table, partitions, session=None):
+    """
+    Copy about the given number of whole partitions of keyspace.table into
+    target.table and return a Sample with the fraction of the table copied.
+    """
+    session = session or get_session()
+    keys = Table(name=table, columns=get_table_columns(keyspace, table, session=session)).primary_keys()
+    columns = ', '.join('"{}"'.format(k) for k in keys)
+    ranges = min(SAMPLE_RANGES, partitions)
+    per_range = -(-partitions // ranges)
+    # Pick the partitions first, a LIMIT on the rows would cut wide partitions short.
+    select = session.prepare('SELECT DISTINCT {} FROM {}.{} WHERE token({}) > ? LIMIT {}'.format(
+        columns, keyspace, table, columns, per_range))
+    picked = set()
+    for start in get_sample_tokens(ranges):
+        for row in session.execute(select, (start,)):
+            picked.add(tuple(row))
+    select = session.prepare('SELECT JSON * FROM {}.{} WHERE {}'.format(
+        keyspace, table, ' AND '.join('"{}" = ?'.format(k) for k in keys)))
+    rows = []
+    for success, result in execute_concurrent_with_args(session, select, list(picked), concurrency=50,
+                                                        raise_on_first_error=True):
+        rows += [(row[0],) for row in result]
+    insert = session.prepare('INSERT INTO {}.{} JSON ?'.format(target, table))
+    execute_concurrent_with_args(session, insert, rows, concurrency=50)
+    total = get_table_size(keyspace, table, session=session).partitions
+    fraction = min(1.0, len(picked) / float(total)) if total else 1.0
+    return Sample(table=table, keys=keys, partitions=len(picked), rows=len(rows), fraction=fraction)
+
+
+def copy_samples(keyspace, target, tables, partitions, session=None):
+    """ Copy a sample of every table that exists in the keyspace and return the Samples by table. """
+    session = session or get_session()
+    existing = get_keyspace_tables(keyspace, session=session)
+    samples = {}
+    for table in tables:
+        if table not in existing:
+            continue
+        echo("Sampling {} partitions of {}... ".format(partitions, table), nl=False)
+        try:
+            sample = copy_sample(keyspace, target, table, partitions, session=session)
+        except Exception as e:
+            # Counter tables can't be written with INSERT JSON, for instance.
+            secho("SKIPPED ({})".format(e), fg='yellow', bold=True)
+            continue
+        secho("OK ({} partitions, {:.4%} of the table)".format(sample.partitions, sample.fraction),
+              fg='green', bold=True)
+        samples[table] = sample
+    return samples
+
+
+def get_scaled_fraction(statement, samples):
+    """
+    Return the fraction of the data the statement ran on, if its cost grows
+    with the size of the table (index builds and statements that don't
+    restrict the partition key), or None if it doesn't.
+    """
+    kind, table = get_statement_kind(statement)
+    if table not in samples:
+        return None
+    if kind == 'create_index':
+        return samples[table].fraction
+    if kind not in ('select', 'update', 'delete'):
+        return None
+    restrictions = get_restrictions(strip_comments(statement))
+    if restrictions is not None and all(k in restrictions for k in samples[table].keys):
+        return None
+    return samples[table].fraction
+
+
+def get_timing(migration, applied, samples):
+    """
+    Extrapolate the full size runtime of a migration applied on the sample.
+    The statements whose cost grows with the data are scaled by the fraction
+    of their table that was sampled, the rest (schema changes, writes to
+    given partitions) count what they took.
+    """
+    projected = 0
+    fractions = []
+    for statement, seconds in applied.durations:
+        fraction = get_scaled_fraction(statement, samples)
+        if fraction is None:
+            projected += seconds
+            continue
+        fractions.append(fraction)
+        projected += seconds / fraction
+    fraction = min(fractions) if fractions else 1.0
+    return Timing(migration=migration, seconds=applied.seconds, fraction=fraction, projected=projected)
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+A small HTTP endpoint with the migration status, for readiness probes and
+dashboards.
+
+The status is kept in a single session and, while the keyspace is up to
+date, cached for a TTL. It's also refreshed as soon as the schema of the
+keyspace changes: the driver keeps cluster.metadata up to date with the
+schema change events pushed by the cluster, so comparing its export costs
+nothing on the cluster. A migration records itself only after its
+statements ran, and may not change the schema at all, so while there are
+pending migrations the status is not cached.
+
+    GET /status  -> 200 with the status as JSON
+    GET /ready   -> 200 if there are no pending migrations, 503 otherwise
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+import json
+import time
+import hashlib
+import threading
+
+from six.moves import BaseHTTPServer, socketserver
+
+from .api import get_migrations, make_status
+from .migrate import get_last_migration
+from .db import get_session
+from .exceptions import ShifterError
+
+
+class StatusCache(object):
+    """
+    The Status of a keyspace, refreshed after ttl seconds, when its schema
+    changes, or on every call while there are pending migrations.
+    """
+    def __init__(self, config, session=None, ttl=30):
+        self.config = config
+        self.session = session or get_session()
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.status = None
+        self.version = None
+        self.fetched = 0
+
+    def get_schema_version(self):
+        """ Return the fingerprint of the keyspace schema known by the driver, or None if it doesn't exist. """
+        keyspace = self.session.cluster.metadata.keyspaces.get(self.config['keyspace'])
+        if keyspace is None:
+            return None
+        return hashlib.md5(keyspace.export_as_string().encode('utf-8')).hexdigest()
+
+    def get(self):
+        """ Return (status, age in seconds). """
+        with self.lock:
+            version = self.get_schema_version()
+            stale = self.status is None or bool(self.status.pending) or version != self.version
+            if stale or time.time() - self.fetched > self.ttl:
+                self.refresh(version)
+            return self.status, time.time() - self.fetched
+
+    def refresh(self, version):
+        migrations = get_migrations()
+        exists = version is not None
+        last = get_last_migration(self.config, session=self.session) if exists else None
+        self.status = make_status(migrations, exists, last)
+        self.version = version
+        self.fetched = time.time()
+
+
+class StatusHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split('?')[0].rstrip('/')
+        if path not in ('/status', '/ready'):
+            return self.respond(404, {'error': 'Not found'})
+        try:
+            status, age = self.server.cache.get()
+        except ShifterError as e:
+            return self.respond(503, {'error': str(e)})
+        body = status._asdict()
+        body.update(pending=len(status.pending), pending_migrations=status.pending,
+                    up_to_date=(status.initialized and not status.pending), age=round(age, 3))
+        if path == '/ready' and not body['up_to_date']:
+            return self.respond(503, body)
+        self.respond(200, body)
+
+    def respond(self, code, body):
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        # Probes hit the endpoint every few seconds, don't flood the output.
+        pass
+
+
+class StatusServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, cache):
+        BaseHTTPServer.HTTPServer.__init__(self, address, StatusHandler)
+        self.cache = cache
+
+
+def serve(config, host='127.0.0.1', port=8500, ttl=30, session=None):
+    """ Serve the status of the keyspace until interrupted. """
+    server = StatusServer((host, port), StatusCache(config, session, ttl))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
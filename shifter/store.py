@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Content-addressed store of the schema snapshot of every migration.
+
+The schema dump is split in its ; separated statements and each one is
+stored compressed under migrations/.snapshots/objects, named after its hash,
+so the tables that don't change are shared by every snapshot. A manifest
+per migration (migrations/.snapshots/manifests/<migration>.json) lists the
+objects the dump is made of, in order, along with its fingerprint.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+import os
+import json
+import zlib
+import uuid
+import hashlib
+
+import six
+
+
+STORE_DIR = 'migrations/.snapshots'
+
+
+def get_hash(text):
+    return hashlib.sha1(text.encode('utf-8') if isinstance(text, six.text_type) else text).hexdigest()
+
+
+def get_object_path(hash):
+    return os.path.join(STORE_DIR, 'objects', hash[:2], hash[2:])
+
+
+def get_manifest_path(migration):
+    return os.path.join(STORE_DIR, 'manifests', '{}.json'.format(migration))
+
+
+def write_file(path, data):
+    """ Write the bytes to the path atomically, so concurrent writers never leave half a file. """
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # Created by a concurrent writer.
+            pass
+    tmp = '{}.{}.tmp'.format(path, uuid.uuid4().hex[:8])
+    file = open(tmp, 'wb')
+    file.write(data)
+    file.close()
+    os.rename(tmp, path)
+
+
+def put_object(text):
+    """ Store the text if it isn't stored yet and return its hash. """
+    hash = get_hash(text)
+    path = get_object_path(hash)
+    if not os.path.isfile(path):
+        write_file(path, zlib.compress(text.encode('utf-8')))
+    return hash
+
+
+def get_object(hash):
+    file = open(get_object_path(hash), 'rb')
+    data = file.read()
+    file.close()
+    return zlib.decompress(data).decode('utf-8')
+
+
+def store_snapshot(migration, schema):
+    """ Store the schema as the snapshot of the migration and return its fingerprint. """
+    if migration.endswith('.cql'):
+        migration = migration[:-4]
+    if isinstance(schema, six.binary_type):
+        schema = schema.decode('utf-8')
+    objects = [put_object(chunk) for chunk in schema.split(';')]
+    fingerprint = get_hash(schema)
+    manifest = {'migration': migration, 'fingerprint': fingerprint, 'objects': objects}
+    write_file(get_manifest_path(migration), json.dumps(manifest, indent=2).encode('utf-8'))
+    return fingerprint
+
+
+def get_stored_migrations():
+    """ Return the names of the migrations with a stored snapshot, in order. """
+    try:
+        files = os.listdir(os.path.join(STORE_DIR, 'manifests'))
+    except OSError:
+        return []
+    return sorted(f[:-5] for f in files if f.endswith('.json'))
+
+
+def resolve_migration(head):
+    """
+    Return the name of the stored migration the head refers to, either by
+    name (00003_add_users) or by number (3), or None if there is none.
+    """
+    stored = get_stored_migrations()
+    if head in stored:
+        return head
+    try:
+        number = int(head)
+    except ValueError:
+        return None
+    for migration in stored:
+        try:
+            if int(migration.split('_')[0]) == number:
+                return migration
+        except ValueError:
+            continue
+    return None
+
+
+def get_stored_snapshot(head):
+    """ Return the schema stored for the head (see resolve_migration), or None if there is none. """
+    migration = resolve_migration(head)
+    if migration is None:
+        return None
+    file = open(get_manifest_path(migration), 'r')
+    manifest = json.load(file)
+    file.close()
+    return ';'.join(get_object(hash) for hash in manifest['objects'])
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Keep a rehearsal keyspace in sync with the migrations directory while the
+migrations are being written.
+
+The rehearsal keyspace is built once from the schema of the keyspace. When a
+pending migration file changes, the migrations applied from it onwards are
+rolled back with the DOWN sections they were applied with (kept in memory,
+the file on disk has already changed) and applied UP again from disk.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+import os
+import time
+
+from .migrate import get_migrations_on_file, get_last_migration, get_pending_migrations
+from .migrate import read_migration, apply_migration
+from .db import get_session, get_current_schema, keyspace_exists
+from .db import create_demo_keyspace, delete_demo_keyspace, get_demo_keyspace_name
+from .cql import get_sections
+from .output import echo, secho
+from .exceptions import ShifterError, MigrationError
+
+
+def get_mtimes():
+    """ Return the modification time of every migration file by name. """
+    mtimes = {}
+    for f in get_migrations_on_file():
+        try:
+            mtimes[f] = os.path.getmtime('migrations/{}'.format(f))
+        except OSError:
+            # Removed while listing (editors replace files on save).
+            continue
+    return mtimes
+
+
+class Watcher(object):
+    """ A rehearsal keyspace with the pending migrations applied as they are on disk. """
+    def __init__(self, config, session=None):
+        self.config = config
+        self.session = session or get_session()
+        self.keyspace = get_demo_keyspace_name()
+        self.schema, self.head = self.get_base()
+        # (file, content) of the migrations applied to the rehearsal keyspace, in order.
+        self.applied = []
+        # The last migration failed half way, the keyspace must be rebuilt.
+        self.dirty = True
+
+    def get_base(self):
+        """ Return the schema the rehearsal keyspace starts from and its head. """
+        if keyspace_exists(self.config['keyspace'], session=self.session):
+            return get_current_schema(self.config), get_last_migration(self.config, session=self.session)
+        genesis = read_migration('00000.cql')
+        if genesis is None:
+            raise MigrationError('Migration genesis (00000.cql) is missing! Forgot to run init command first?')
+        return get_sections(genesis)[0][1], None
+
+    def rebuild(self):
+        create_demo_keyspace(self.schema, self.config['keyspace'], self.keyspace, session=self.session)
+        self.applied = []
+        self.dirty = False
+
+    def rollback(self, keep):
+        """ Roll back the applied migrations but the first keep ones. """
+        while len(self.applied) > keep:
+            f, content = self.applied[-1]
+            res, err = apply_migration(f, False, self.keyspace, session=self.session, content=content)
+            if not res:
+                secho('Unable to roll back {}: {}'.format(f, err), fg='yellow')
+                self.rebuild()
+                return
+            self.applied.pop()
+
+    def sync(self, changed=()):
+        """
+        Bring the rehearsal keyspace up to date with the pending migrations on
+        disk. Return True if all of them could be applied.
+        """
+        pending, up = get_pending_migrations(self.head, get_migrations_on_file())
+        for f in sorted(changed):
+            if f not in pending:
+                secho('{} is not pending on {}, ignoring the change.'.format(f, self.config['keyspace']),
+                      fg='yellow')
+        if not up:
+            pending = []
+        contents = [(f, read_migration(f)) for f in pending]
+        if self.dirty:
+            self.rebuild()
+        keep = 0
+        while keep < min(len(self.applied), len(contents)) and self.applied[keep] == contents[keep]:
+            keep += 1
+        self.rollback(keep)
+        for f, content in contents[len(self.applied):]:
+            res, err = apply_migration(f, True, self.keyspace, session=self.session, content=content)
+            if not res:
+                secho('{}'.format(err), fg='red')
+                self.dirty = content is not None
+                return False
+            self.applied.append((f, content))
+        return True
+
+    def watch(self, interval=0.5):
+        """ Sync the rehearsal keyspace every time a migration file changes, until interrupted. """
+        mtimes = get_mtimes()
+        try:
+            self.sync()
+            echo('Watching migrations/ for changes, press Ctrl+C to stop.')
+            while True:
+                time.sleep(interval)
+                current = get_mtimes()
+                if current == mtimes:
+                    continue
+                changed = [f for f in current if mtimes.get(f) != current[f]]
+                mtimes = current
+                started = time.time()
+                try:
+                    ok = self.sync(changed)
+                except ShifterError as e:
+                    secho('{}'.format(e), fg='red')
+                    self.dirty = True
+                    continue
+                head = self.applied[-1][0] if self.applied else self.head
+                secho('{} at {} ({:.2f}s)'.format('Up to date' if ok else 'Stopped', head or 'genesis',
+                                                  time.time() - started),
+                      fg=('green' if ok else 'red'), bold=True)
+        except KeyboardInterrupt:
+            echo()
+        finally:
+            delete_demo_keyspace(self.keyspace, session=self.session)
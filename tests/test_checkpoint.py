@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+from collections import namedtuple
+
+import pytest
+
+from shifter.api import check_checkpoint
+from shifter.exceptions import MigrationError
+from shifter.migrate import get_statements_hash
+
+Checkpoint = namedtuple('Checkpoint', ['hash', 'up', 'applied'])
+
+CONTENT = """--UP--
+ALTER TABLE users ADD email text;
+ALTER TABLE users ADD phone txt;
+ALTER TABLE users ADD age int;
+--DOWN--
+ALTER TABLE users DROP age;
+ALTER TABLE users DROP phone;
+ALTER TABLE users DROP email;
+"""
+
+
+@pytest.fixture
+def migration(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    tmp_path.joinpath('migrations').mkdir()
+    tmp_path.joinpath('migrations', '00001_users.cql').write_text(CONTENT)
+    return tmp_path.joinpath('migrations', '00001_users.cql')
+
+
+def get_checkpoint(applied, up=True):
+    return Checkpoint(hash=get_statements_hash(['ALTER TABLE users ADD email text'][:applied]), up=up,
+                      applied=applied)
+
+
+def test_resume_after_fixing_the_failed_statement(migration):
+    migration.write_text(CONTENT.replace('phone txt', 'phone text'))
+    assert check_checkpoint(get_checkpoint(1), ['00001_users.cql'], True) == 1
+
+
+def test_applied_statements_must_not_change(migration):
+    migration.write_text(CONTENT.replace('email text', 'email varchar'))
+    with pytest.raises(MigrationError):
+        check_checkpoint(get_checkpoint(1), ['00001_users.cql'], True)
+
+
+def test_checkpoint_in_the_other_direction_is_ignored(migration):
+    assert check_checkpoint(get_checkpoint(1, up=False), ['00001_users.cql'], True) == 0
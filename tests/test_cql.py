@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from shifter.cql import Statement, split_statements, join_batches, get_statement_kind
+
+
+def test_split_statements_keeps_lines():
+    text = "\nCREATE TABLE a (id int PRIMARY KEY);\n\n/* note */\nINSERT INTO a (id) VALUES (1);\n"
+    statements = split_statements(text, line=4)
+    assert [s.line for s in statements] == [5, 8]
+    assert statements[1].text == "/* note */\nINSERT INTO a (id) VALUES (1)"
+
+
+def test_split_statements_skips_comment_only_chunks():
+    assert split_statements("/* nothing */;\n-- here\n;") == []
+
+
+def test_split_statements_joins_multiline_batches():
+    text = "BEGIN BATCH\nINSERT INTO a (id) VALUES (1);\nINSERT INTO a (id) VALUES (2);\nAPPLY BATCH;\nSELECT * FROM a;"
+    statements = split_statements(text)
+    assert len(statements) == 2
+    assert statements[0].text.startswith('BEGIN BATCH')
+    assert statements[0].text.endswith('APPLY BATCH')
+    assert get_statement_kind(statements[0].text) == ('batch', None)
+    assert get_statement_kind(statements[1].text) == ('select', 'a')
+
+
+def test_join_batches_strings():
+    statements = ['BEGIN UNLOGGED BATCH INSERT INTO a (id) VALUES (1)', 'APPLY BATCH', 'SELECT * FROM a']
+    assert join_batches(statements) == ['BEGIN UNLOGGED BATCH INSERT INTO a (id) VALUES (1); APPLY BATCH',
+                                        'SELECT * FROM a']
+
+
+def test_join_batches_unterminated():
+    statements = [Statement('BEGIN BATCH INSERT INTO a (id) VALUES (1)', 1, 'UP'),
+                  Statement('INSERT INTO a (id) VALUES (2)', 2, 'UP')]
+    joined = join_batches(statements)
+    assert len(joined) == 1
+    assert joined[0].line == 1
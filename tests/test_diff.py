@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import pytest
+
+from shifter import api
+from shifter.exceptions import ShifterError
+from shifter.store import store_snapshot, get_stored_snapshot
+
+GENESIS = """CREATE KEYSPACE ks WITH replication = {'class': 'SimpleStrategy', 'replication_factor': '1'};
+
+CREATE TABLE ks.users (
+    id uuid PRIMARY KEY,
+    name text
+) WITH comment = 'a; b';
+"""
+
+SECOND = GENESIS.replace("    name text\n", "    name text,\n    email text\n") + """
+CREATE TABLE ks.shift_migrations (
+    type text,
+    time timeuuid,
+    PRIMARY KEY (type, time)
+) WITH CLUSTERING ORDER BY (time DESC);
+
+CREATE TABLE ks.shift_lease (
+    name text PRIMARY KEY,
+    owner text
+);
+"""
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    store_snapshot('00000.cql', GENESIS)
+    store_snapshot('00001_add_email', SECOND)
+
+
+def test_snapshots_are_restored_exactly(store):
+    assert get_stored_snapshot('0') == GENESIS
+    assert get_stored_snapshot('00001_add_email') == SECOND
+
+
+def test_diff_ignores_shifter_tables(store):
+    assert api.diff('0', '1') == ['ALTER TABLE "users" ADD "email" text']
+    assert api.diff('1', '0') == ['ALTER TABLE "users" DROP "email"']
+
+
+def test_diff_unknown_head(store):
+    with pytest.raises(ShifterError):
+        api.diff('0', '7')
+
+
+def test_diff_keeps_user_tables_named_like_shifter_ones(store):
+    store_snapshot('00002_add_schedule', SECOND + """
+CREATE TABLE ks.shift_schedule (
+    day date PRIMARY KEY,
+    worker text
+);
+""")
+    changes = api.diff('1', '2')
+    assert len(changes) == 1
+    assert changes[0].startswith('CREATE TABLE shift_schedule (')
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from shifter.cql import Statement, parse_table
+from shifter.estimate import TableSize, estimate_statement, get_touched_partitions
+
+USERS = parse_table("""
+CREATE TABLE ks.users (
+    country text,
+    id uuid,
+    day int,
+    name text,
+    PRIMARY KEY ((country, id), day)
+)
+""")
+SIZE = TableSize(partitions=1000000, bytes=1000000000)
+
+
+class Catalog(object):
+    """ The catalog of a keyspace with a single, big, users table. """
+    def get_table(self, name):
+        return USERS if name == 'users' else None
+
+    def get_size(self, name):
+        return SIZE if name == 'users' else TableSize(partitions=0, bytes=0)
+
+    def update(self, kind, name):
+        pass
+
+
+def estimate(text):
+    return estimate_statement('00001_test.cql', Statement(text=text, line=1, section='UP'), Catalog(), 5000)
+
+
+def test_insert_touches_one_partition():
+    e = estimate("INSERT INTO users (country, id, day, name) VALUES ('MX', uuid(), 1, 'x')")
+    assert (e.kind, e.partitions, e.bytes) == ('insert', 1, 1000)
+
+
+def test_full_key_update():
+    assert get_touched_partitions("UPDATE users SET name = 'x' WHERE country = 'MX' AND id = uuid() AND day = 1",
+                                  USERS, SIZE) == 1
+
+
+def test_in_on_the_partition_key():
+    assert get_touched_partitions("DELETE FROM users WHERE country IN ('MX', 'US', 'CA') AND id IN (uuid(), uuid())",
+                                  USERS, SIZE) == 6
+
+
+def test_unrestricted_statements_touch_the_whole_table():
+    assert get_touched_partitions("SELECT * FROM users", USERS, SIZE) == SIZE.partitions
+    assert get_touched_partitions("UPDATE users SET name = 'x' WHERE country = 'MX'", USERS, SIZE) == SIZE.partitions
+    e = estimate("UPDATE users SET name = 'x' WHERE name = 'y' ALLOW FILTERING")
+    assert (e.partitions, e.bytes, e.seconds) == (SIZE.partitions, SIZE.bytes, 200)
+
+
+def test_batch_counts_its_statements():
+    e = estimate("BEGIN BATCH INSERT INTO users (country, id, day) VALUES ('MX', uuid(), 1); "
+                 "INSERT INTO users (country, id, day) VALUES ('US', uuid(), 1); APPLY BATCH")
+    assert (e.kind, e.partitions) == ('batch', 2)
+
+
+def test_schema_changes():
+    e = estimate("CREATE INDEX ON users (name)")
+    assert (e.partitions, e.schema_change) == (SIZE.partitions, True)
+    e = estimate("ALTER TABLE users ADD email text")
+    assert (e.partitions, e.schema_change) == (0, True)
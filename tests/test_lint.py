@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from shifter.cql import parse_schema
+from shifter.lint import lint_content, LARGE_BATCH
+from shifter.migrate import get_migration_statements
+
+SCHEMA = """
+CREATE TABLE ks.users (
+    id uuid,
+    name text,
+    created timestamp,
+    PRIMARY KEY (id)
+);
+"""
+
+
+def get_rules(content, schema=SCHEMA):
+    return [(f.line, f.rule) for f in lint_content(content, 'test.cql', parse_schema(schema))]
+
+
+def test_allow_filtering_and_scans():
+    content = ("--UP--\n"
+               "UPDATE users SET name = 'x' WHERE name = 'y' ALLOW FILTERING;\n"
+               "SELECT * FROM users;\n"
+               "SELECT * FROM users WHERE id = 5b6962dd-3f90-4c93-8f61-eabfa4a803e2;\n"
+               "--DOWN--\n")
+    assert get_rules(content) == [(2, 'allow-filtering'), (2, 'unbounded-scan'), (3, 'unbounded-scan')]
+
+
+def test_indexes():
+    content = "--UP--\nCREATE INDEX ON users (created);\nCREATE INDEX ON users (name);\n--DOWN--\n"
+    assert get_rules(content) == [(2, 'high-cardinality-index'), (3, 'secondary-index')]
+
+
+def test_drop_recreate():
+    content = "--UP--\nDROP TABLE users;\nCREATE TABLE users (id int PRIMARY KEY);\n--DOWN--\n"
+    assert get_rules(content) == [(3, 'drop-recreate')]
+
+
+def test_suppressions():
+    content = ("/* shifter: disable-file=secondary-index */\n--UP--\n"
+               "CREATE INDEX ON users (name);\n"
+               "/* shifter: disable=unbounded-scan */\nSELECT * FROM users;\n--DOWN--\n")
+    assert get_rules(content) == []
+
+
+def test_large_multiline_batch_is_one_statement_everywhere():
+    inserts = ''.join("INSERT INTO users (id) VALUES ({});\n".format(i) for i in range(LARGE_BATCH + 5))
+    content = "--UP--\nBEGIN BATCH\n{}APPLY BATCH;\n--DOWN--\nTRUNCATE users;\n".format(inserts)
+    assert get_rules(content) == [(2, 'large-batch')]
+    statements = get_migration_statements(content, True)
+    assert len(statements) == 1
+    assert statements[0].startswith('BEGIN BATCH\nINSERT')
+
+
+def test_migration_statements_without_down():
+    assert get_migration_statements("--UP--\nSELECT * FROM users;\n", True) is None
+    assert get_migration_statements("--UP--\nSELECT * FROM users;\n--DOWN--\n\n", False) == []
+
+
+def test_only_the_given_sections():
+    content = ("--UP--\nUPDATE users SET name = 'x' WHERE name = 'y' ALLOW FILTERING;\n"
+               "--DOWN--\nSELECT * FROM users;\n")
+    findings = lint_content(content, 'test.cql', parse_schema(SCHEMA), sections=('DOWN',))
+    assert [(f.line, f.rule) for f in findings] == [(4, 'unbounded-scan')]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from shifter.migrate import Applied
+from shifter.sample import Sample, get_timing
+
+SAMPLES = {'users': Sample(table='users', keys=['id'], partitions=10, rows=10, fraction=0.001)}
+
+
+def get_projected(*durations):
+    applied = Applied(statements=len(durations), seconds=sum(d for s, d in durations), coordinator='',
+                      durations=list(durations))
+    return get_timing('00001_test.cql', applied, SAMPLES)
+
+
+def test_schema_changes_are_not_scaled():
+    timing = get_projected(('ALTER TABLE users ADD email text', 0.5))
+    assert timing.projected == 0.5
+    assert timing.fraction == 1.0
+
+
+def test_scans_and_index_builds_are_scaled():
+    timing = get_projected(("UPDATE users SET email = '' WHERE name = 'x' ALLOW FILTERING", 0.25),
+                           ('CREATE INDEX ON users (email)', 0.5))
+    assert round(timing.projected, 6) == 750
+    assert timing.fraction == 0.001
+
+
+def test_point_writes_and_unsampled_tables_are_not_scaled():
+    timing = get_projected(("UPDATE users SET email = '' WHERE id = 1", 0.25), ('SELECT * FROM events', 0.5))
+    assert timing.projected == 0.75
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from shifter import serve
+from shifter.serve import StatusCache
+
+
+class Keyspace(object):
+    def __init__(self, schema):
+        self.schema = schema
+
+    def export_as_string(self):
+        return self.schema
+
+
+class Session(object):
+    """ A session whose driver metadata only knows the given keyspace. """
+    def __init__(self, schema):
+        self.keyspace = Keyspace(schema)
+        self.cluster = self
+
+    @property
+    def metadata(self):
+        return self
+
+    @property
+    def keyspaces(self):
+        return {'ks': self.keyspace}
+
+
+def make_cache(monkeypatch, heads):
+    """ Return a StatusCache whose keyspace head is read from heads, and the number of reads. """
+    reads = []
+
+    def get_last_migration(config, session=None):
+        reads.append(heads[0])
+        return heads[0]
+    monkeypatch.setattr(serve, 'get_migrations', lambda: ['00000.cql', '00001_a.cql', '00002_b.cql'])
+    monkeypatch.setattr(serve, 'get_last_migration', get_last_migration)
+    session = Session('CREATE TABLE ks.a (id int PRIMARY KEY)')
+    return StatusCache({'keyspace': 'ks'}, session=session, ttl=3600), session, reads
+
+
+def test_up_to_date_status_is_cached(monkeypatch):
+    cache, session, reads = make_cache(monkeypatch, ['00002_b'])
+    assert cache.get()[0].pending == []
+    cache.get()
+    assert len(reads) == 1
+    session.keyspace.schema += ';CREATE TABLE ks.b (id int PRIMARY KEY)'
+    cache.get()
+    assert len(reads) == 2
+
+
+def test_status_is_not_cached_while_pending(monkeypatch):
+    heads = ['00001_a']
+    cache, session, reads = make_cache(monkeypatch, heads)
+    assert cache.get()[0].pending == ['00002_b.cql']
+    # A migration that only changes data, recorded without a schema change.
+    heads[0] = '00002_b'
+    assert cache.get()[0].pending == []
+    cache.get()
+    assert len(reads) == 2